@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from collections import Counter, deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", 10000))
+# reject: 503 when full, drop_oldest: evict the oldest alert of the server with the most queued,
+# drop_tenant: 429 for a server over its share
+QUEUE_FULL_POLICY = os.getenv("QUEUE_FULL_POLICY", "reject")
+QUEUE_TENANT_MAX = int(os.getenv("QUEUE_TENANT_MAX", max(1, QUEUE_MAX_SIZE // 10)))
+QUEUE_RETRY_AFTER = int(os.getenv("QUEUE_RETRY_AFTER", 5))
+# Alerts a server may take per round-robin turn before the next server's alerts are consumed
+QUEUE_QUANTUM = float(os.getenv("QUEUE_QUANTUM", 1))
+
+if QUEUE_QUANTUM <= 0:
+    raise RuntimeError(f"QUEUE_QUANTUM must be above 0, got {QUEUE_QUANTUM}")
+
+POLICIES = ("reject", "drop_oldest", "drop_tenant")
+
+class TenantQueueFull(asyncio.QueueFull):
+    pass
+
+def tenant_of(alert):
+    return getattr(alert, 'server_id', None)
+
+# Deficit round-robin over one FIFO per server: each turn a server may take QUEUE_QUANTUM alerts
+# before the next server with queued alerts goes, so a server firing thousands of alerts only
+# delays its own. Alerts of one server stay in order
+class FairQueue:
+    def __init__(self, quantum):
+        # A server with no credit would never get a turn, and popleft would spin forever
+        if quantum <= 0:
+            raise ValueError(f"Quantum must be above 0, got {quantum}")
+        self.quantum = quantum
+        # tenant -> deque of (enqueued_at, alert)
+        self.tenants = {}
+        # Tenants with queued alerts, in turn order
+        self.active = deque()
+        self.deficits = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for items in self.tenants.values():
+            for _, item in items:
+                yield item
+
+    def append(self, item):
+        tenant = tenant_of(item)
+        items = self.tenants.get(tenant)
+        if items is None:
+            items = self.tenants[tenant] = deque()
+            self.active.append(tenant)
+            self.deficits[tenant] = 0
+        items.append((time.monotonic(), item))
+        self.size += 1
+
+    def popleft(self):
+        while True:
+            tenant = self.active[0]
+            if self.deficits[tenant] < 1:
+                self.deficits[tenant] += self.quantum
+            if self.deficits[tenant] >= 1:
+                break
+            self.active.rotate(-1)
+        items = self.tenants[tenant]
+        _, item = items.popleft()
+        self.deficits[tenant] -= 1
+        self.size -= 1
+        if not items:
+            # An idle server does not bank credit for later
+            self.active.popleft()
+            del self.tenants[tenant]
+            del self.deficits[tenant]
+        elif self.deficits[tenant] < 1:
+            self.active.rotate(-1)
+        return item
+
+    # Drops the oldest alert of the server with the most queued, for the drop_oldest policy
+    def evict(self):
+        tenant = max(self.tenants, key=lambda t: len(self.tenants[t]))
+        items = self.tenants[tenant]
+        items.popleft()
+        self.size -= 1
+        if not items:
+            self.active.remove(tenant)
+            del self.tenants[tenant]
+            del self.deficits[tenant]
+
+    def depth(self, tenant):
+        items = self.tenants.get(tenant)
+        return len(items) if items else 0
+
+    def oldest(self):
+        if not self.tenants:
+            return None
+        return min(items[0][0] for items in self.tenants.values())
+
+class AlertQueue(asyncio.Queue):
+    def __init__(self, maxsize=QUEUE_MAX_SIZE, policy=QUEUE_FULL_POLICY, tenant_max=QUEUE_TENANT_MAX, quantum=QUEUE_QUANTUM):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}, expected one of {POLICIES}")
+        self.quantum = quantum
+        super().__init__(maxsize)
+        self.policy = policy
+        self.tenant_max = tenant_max
+        self.rejected = 0
+        self.dropped = 0
+        # Per server rejections, trimmed to the heaviest servers so random ids cannot grow it
+        self.tenant_rejected = Counter()
+
+    def _init(self, maxsize):
+        self._queue = FairQueue(self.quantum)
+
+    def _reject(self, tenant):
+        self.rejected += 1
+        self.tenant_rejected[tenant] += 1
+        if len(self.tenant_rejected) > 1000:
+            self.tenant_rejected = Counter(dict(self.tenant_rejected.most_common(100)))
+
+    # Non-blocking put for the webhook, applying the configured overflow policy
+    def offer(self, alert):
+        tenant = tenant_of(alert)
+        if self.policy == "drop_tenant" and self._queue.depth(tenant) >= self.tenant_max:
+            self._reject(tenant)
+            raise TenantQueueFull()
+        if self.full():
+            if self.policy != "drop_oldest":
+                self._reject(tenant)
+                raise asyncio.QueueFull()
+            self._queue.evict()
+            self.task_done()
+            self.dropped += 1
+        self.put_nowait(alert)
+
+    def oldest_age(self):
+        oldest = self._queue.oldest()
+        if oldest is None:
+            return 0.0
+        return time.monotonic() - oldest
+
+    # Servers with the most queued alerts
+    def tenant_depths(self, top=10):
+        tenants = sorted(self._queue.tenants.items(), key=lambda t: len(t[1]), reverse=True)[:top]
+        return {tenant: len(items) for tenant, items in tenants}
+
+    def stats(self):
+        return {
+            "depth": self.qsize(),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "oldest_age_seconds": round(self.oldest_age(), 3),
+            "quantum": self.quantum,
+            "tenants": len(self._queue.tenants),
+            "top_tenants": {str(tenant): depth for tenant, depth in self.tenant_depths().items()},
+            "rejected": self.rejected,
+            "top_rejected": {str(tenant): count for tenant, count in self.tenant_rejected.most_common(10)},
+            "dropped": self.dropped,
+        }
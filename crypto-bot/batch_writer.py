@@ -0,0 +1,94 @@
+import asyncio
+from shared import logger
+
+# Buffers rows and hands them to `flush` in batches, either when batch_size rows are
+# waiting or flush_interval seconds after the first buffered row, whichever comes first
+class BatchWriter:
+    def __init__(self, flush, batch_size=100, flush_interval=0.02, name="batch"):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self.rows = []
+        self.waiters = []
+        self.batches = 0
+        self.written = 0
+        self.errors = 0
+        self._timer = None
+        self._pending = set()
+        self.in_flight = 0
+
+    # Buffer a row; the returned future resolves once its batch is written
+    def add(self, row):
+        future = asyncio.get_running_loop().create_future()
+        self.rows.append(row)
+        self.waiters.append(future)
+        if len(self.rows) >= self.batch_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_now)
+        return future
+
+    # Buffer a row without waiting on it, failures are only logged
+    def add_nowait(self, row):
+        self.add(row).add_done_callback(lambda f: f.exception())
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.rows:
+            return
+        rows, waiters = self.rows, self.waiters
+        self.rows, self.waiters = [], []
+        self.in_flight += len(rows)
+        task = asyncio.create_task(self._write(rows, waiters))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _write(self, rows, waiters):
+        try:
+            await self.flush(rows)
+            self.batches += 1
+            self.written += len(rows)
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Batch write to {self.name} ({len(rows)} rows) failed: {e}")
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+        except asyncio.CancelledError:
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(ConnectionError(f"{self.name} writer closed before the batch was written"))
+            raise
+        finally:
+            self.in_flight -= len(rows)
+
+    # Rows buffered or being written
+    def backlog(self):
+        return len(self.rows) + self.in_flight
+
+    # Writes what is buffered. Writes still running after `timeout` seconds are cancelled and
+    # their callers get an error, so shutdown does not hang on an unreachable database
+    async def close(self, timeout=None):
+        self._flush_now()
+        if not self._pending:
+            return
+        _, unfinished = await asyncio.wait(set(self._pending), timeout=timeout)
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "buffered": len(self.rows),
+            "in_flight": self.in_flight,
+            "batches": self.batches,
+            "written": self.written,
+            "errors": self.errors,
+        }
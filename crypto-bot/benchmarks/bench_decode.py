@@ -0,0 +1,100 @@
+# Webhook parsing, old vs new: the pydantic path (AlertPayload + model_dump into a dict) against the fast
+# path (orjson + the precompiled schema into a slotted Alert). Reports decode rate, bytes allocated
+# while decoding, bytes held per queued alert, and requests/sec through a FastAPI endpoint for each.
+# Run from crypto-bot/: python -m benchmarks.bench_decode [iterations]
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+
+import httpx
+import orjson
+from fastapi import FastAPI, Request
+from models import AlertPayload, Alert
+
+BODY = json.dumps({
+    "ticker": "BTCUSD",
+    "alert": "Moving up by 1% last hour",
+    "server_id": 1400939895618535547,
+    "time": "2025-07-28T15:34:00Z",
+    "signal_type": "buy",
+    "secret": "secret",
+    "open": "29500", "close": "29600", "high": "29700", "low": "29400",
+    "interval": "1h",
+    "exchange": "BINANCE",
+}).encode()
+
+def pydantic_path(body):
+    return AlertPayload.model_validate(json.loads(body)).model_dump(exclude_unset=True)
+
+def fast_path(body):
+    return Alert.from_dict(orjson.loads(body), time.time())
+
+def decode_rate(decode, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode(BODY)
+    return iterations / (time.perf_counter() - start)
+
+# Peak heap above the baseline while one body is decoded, including intermediates freed afterwards
+def peak_per_decode(decode, iterations):
+    tracemalloc.start()
+    total = 0
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        decode(BODY)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - before
+    tracemalloc.stop()
+    return total / iterations
+
+def held_per_alert(decode, count):
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    held = [decode(BODY) for _ in range(count)]
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return (end - start) / count
+
+def build_app():
+    app = FastAPI()
+    queue = asyncio.Queue()
+
+    @app.post('/pydantic')
+    async def old(payload: AlertPayload):
+        queue.put_nowait(payload.model_dump(exclude_unset=True))
+        return {"status": "success"}
+
+    @app.post('/fast')
+    async def new(request: Request):
+        queue.put_nowait(fast_path(await request.body()))
+        return {"status": "success"}
+
+    return app, queue
+
+async def requests_per_second(path, requests):
+    app, queue = build_app()
+    headers = {"Content-Type": "application/json"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.post(path, content=BODY, headers=headers)
+        elapsed = time.perf_counter() - start
+    assert queue.qsize() == requests
+    return requests / elapsed
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"{'path':>9} {'decodes/s':>11} {'peak B/decode':>14} {'held B/alert':>13} {'requests/s':>11}")
+    for name, decode, path in (("pydantic", pydantic_path, '/pydantic'), ("fast", fast_path, '/fast')):
+        rate = decode_rate(decode, iterations)
+        allocated = peak_per_decode(decode, 1000)
+        held = held_per_alert(decode, 10000)
+        rps = asyncio.run(requests_per_second(path, 3000))
+        print(f"{name:>9} {rate:>11.0f} {allocated:>14.0f} {held:>13.0f} {rps:>11.0f}")
+
+if __name__ == "__main__":
+    main()
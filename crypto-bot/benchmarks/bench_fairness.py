@@ -0,0 +1,54 @@
+# Noisy neighbour: one server dumps a burst of alerts into the ingest queue while quiet servers
+# send a few each, and a consumer drains it at a fixed rate. Reports how long the quiet servers'
+# alerts wait behind the burst with a plain FIFO queue and with the round-robin AlertQueue.
+# Run from crypto-bot/: python -m benchmarks.bench_fairness [burst] [quiet servers] [alerts/s]
+import asyncio
+import sys
+import time
+from alert_queue import AlertQueue
+
+class Item:
+    __slots__ = ('server_id', 'queued')
+
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.queued = time.monotonic()
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run(queue, burst, quiet, rate):
+    waits = {"noisy": [], "quiet": []}
+    for _ in range(burst):
+        queue.put_nowait(Item(0))
+    # The quiet servers' alerts arrive just after the burst
+    for n in range(5):
+        for server_id in range(1, quiet + 1):
+            queue.put_nowait(Item(server_id))
+    pending = quiet * 5
+    interval = 1 / rate
+    while pending:
+        item = queue.get_nowait()
+        await asyncio.sleep(interval)
+        wait = time.monotonic() - item.queued
+        if item.server_id:
+            waits["quiet"].append(wait)
+            pending -= 1
+        else:
+            waits["noisy"].append(wait)
+    return waits
+
+async def main():
+    burst = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    quiet = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    print(f"burst of {burst} from one server, 5 alerts from each of {quiet} quiet servers, consumed at {rate:.0f}/s")
+    for name, queue in (("fifo", asyncio.Queue()), ("round-robin", AlertQueue(maxsize=0))):
+        waits = await run(queue, burst, quiet, rate)
+        quiet_waits = waits["quiet"]
+        print(f"{name:12} quiet p50 {percentile(quiet_waits, 0.5) * 1000:8.1f} ms  p99 {percentile(quiet_waits, 0.99) * 1000:8.1f} ms"
+              f"  (noisy alerts consumed meanwhile: {len(waits['noisy'])})")
+
+if __name__ == "__main__":
+    asyncio.run(main())
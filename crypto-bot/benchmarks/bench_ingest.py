@@ -0,0 +1,71 @@
+# Ingest throughput of /webhook (one alert per request) against /webhook/batch with a JSON array
+# and with an NDJSON body. Runs the FastAPI app in-process, without the bot or the database.
+# Run from crypto-bot/: python -m benchmarks.bench_ingest [alerts] [batch_size]
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("QUEUE_MAX_SIZE", "1000000")
+os.environ.setdefault("WEBHOOK_RATE", "0")
+os.environ["OUTBOX_ENABLED"] = "false"
+
+import httpx
+from main import app
+from shared import queue
+
+def make_alert(i):
+    return {
+        "server_id": 1400939895618535547 + i % 50,
+        "ticker": f"T{i % 200}USD",
+        "alert": "Moving up by 1% last hour",
+        "signal_type": "buy",
+        "time": "2025-07-28T15:34:00Z",
+        "open": 29500, "close": 29600, "high": 29700, "low": 29400,
+        "interval": "1h",
+        "exchange": "BINANCE",
+    }
+
+def drain():
+    while not queue.empty():
+        queue.get_nowait()
+        queue.task_done()
+
+async def single(client, alerts):
+    for alert in alerts:
+        response = await client.post('/webhook', json=alert)
+        assert response.status_code == 200, response.text
+
+async def batch_array(client, alerts, size):
+    for i in range(0, len(alerts), size):
+        response = await client.post('/webhook/batch', json=alerts[i:i + size])
+        assert response.json()["rejected"] == 0, response.text
+
+async def batch_ndjson(client, alerts, size):
+    for i in range(0, len(alerts), size):
+        body = "\n".join(json.dumps(a) for a in alerts[i:i + size])
+        response = await client.post('/webhook/batch', content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.json()["rejected"] == 0, response.text
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    alerts = [make_alert(i) for i in range(count)]
+
+    print(f"{count} alerts, batches of {size}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, run in (("single", lambda: single(client, alerts)),
+                          ("batch json", lambda: batch_array(client, alerts, size)),
+                          ("batch ndjson", lambda: batch_ndjson(client, alerts, size))):
+            drain()
+            start = time.perf_counter()
+            await run()
+            elapsed = time.perf_counter() - start
+            assert queue.qsize() == count
+            print(f"{name:>13}: {count / elapsed:>9.0f} alerts/sec")
+    drain()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+# Event-loop time spent in logging per alert, and heartbeat lag, for the old synchronous
+# stdout + FileHandler setup against the QueueHandler pipeline from logs.py, with every
+# per-alert line logged and with them sampled. write_ms simulates a slow log sink (a full pipe
+# to the container runtime, a slow disk) by sleeping on every stdout write.
+# Run from crypto-bot/: python -m benchmarks.bench_logging [alerts] [write_ms]
+import asyncio
+import atexit
+import logging
+import os
+import sys
+import tempfile
+import time
+import logs
+from models import Alert
+
+logger = logging.getLogger("bench")
+
+ALERT = Alert.from_dict({
+    "ticker": "BTCUSD", "alert": "Moving up by 1% last hour", "server_id": 1400939895618535547,
+    "time": "2025-07-28T15:34:00Z", "signal_type": "buy", "open": 29500, "close": 29600,
+    "high": 29700, "low": 29400, "interval": "1h", "exchange": "BINANCE",
+})
+
+# The per-alert INFO lines process_alert used to emit
+def log_everything(alert):
+    logger.info(f"Alert received in queue: {alert}")
+    logger.info("BUY")
+    logger.info(f"Looking for channel with server_id={alert.server_id}, ticker={alert.ticker}, signal_type=BUY")
+    logger.info(f"Query result: (True, None), 55")
+    logger.info("✅ Secret passed!")
+
+def trace(message, *args):
+    if logs.sampled.get():
+        logger.info(message, *args)
+
+# The same lines as sampled detail lines
+def log_sampled(alert):
+    logs.begin_alert(alert)
+    trace("Alert received in queue: %s", alert)
+    trace("Looked up channel for server_id=%s, ticker=%s, signal_type=%s: %s, %s", alert.server_id, alert.ticker, "BUY", (True, None), 55)
+    trace("✅ Secret passed!")
+
+class SlowFile:
+    def __init__(self, path, delay):
+        self.file = open(path, "w")
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def sync_pipeline(directory):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout), logging.FileHandler(os.path.join(directory, "sync.log"), encoding="utf-8", mode="w")],
+        force=True,
+    )
+    return None, None
+
+def queue_pipeline(directory):
+    logs.LOG_FILE = os.path.join(directory, "queue.log")
+    handler, listener = logs.setup_logging()
+    atexit.unregister(listener.stop)
+    return handler, listener
+
+async def measure(log_alert, alerts):
+    lags = []
+    done = False
+
+    async def heartbeat():
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.01)
+    blocked = 0.0
+    for n in range(alerts):
+        started = time.perf_counter()
+        log_alert(ALERT)
+        blocked += time.perf_counter() - started
+        # Yield like a consumer awaiting its DB lookup and send between alerts
+        if n % 20 == 0:
+            await asyncio.sleep(0)
+    done = True
+    await beat
+    lags.sort()
+    return blocked / alerts, lags[int(0.99 * (len(lags) - 1))], lags[-1]
+
+def main():
+    alerts = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    write_delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 0.05) / 1000
+    # Large enough that nothing is dropped, so both pipelines write every line
+    logs.LOG_QUEUE_SIZE = alerts * 5 + 1
+    out = sys.stdout
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Log lines meant for stdout go to a file too, like a container log pipe
+        sys.stdout = SlowFile(os.path.join(directory, "stdout.log"), write_delay)
+        try:
+            for name, setup, log_alert in (
+                ("sync, every line", sync_pipeline, log_everything),
+                ("queue, every line", queue_pipeline, log_everything),
+                ("queue, sampled 1%", queue_pipeline, log_sampled),
+            ):
+                logs.LOG_SAMPLE_RATE = 0.01
+                handler, listener = setup(directory)
+                per_alert, p99, worst = asyncio.run(measure(log_alert, alerts))
+                if listener is not None:
+                    listener.stop()
+                results.append((name, per_alert, p99, worst))
+        finally:
+            logging.getLogger().handlers = []
+            sys.stdout.close()
+            sys.stdout = out
+
+    print(f"{alerts} alerts, {write_delay * 1000:.2f} ms per stdout write")
+    print(f"{'pipeline':>20} {'loop us/alert':>14} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for name, per_alert, p99, worst in results:
+        print(f"{name:>20} {per_alert * 1e6:>14.1f} {p99 * 1000:>11.2f} {worst * 1000:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Per-alert channel matching: the subscription index against scanning every pattern of the server,
+# which is what a wildcard-aware SQL match would have to do per alert. No database needed.
+# Run from crypto-bot/: python -m benchmarks.bench_routing [patterns per server] [lookups]
+import random
+import sys
+import time
+from routing import SubscriptionIndex, ANY
+
+SERVERS = 100
+SIGNALS = ['NONE', 'BUY', 'SELL', ANY]
+EXCHANGES = [ANY, 'BINANCE', 'COINBASE']
+
+def build(patterns):
+    rng = random.Random(1)
+    index = SubscriptionIndex()
+    rows = []
+    for server_id in range(SERVERS):
+        for p in range(patterns):
+            pattern = f"T{p}USD" if p % 4 else f"T{p}*"
+            row = (server_id, pattern, rng.choice(SIGNALS), rng.choice(EXCHANGES), 1000 + p % 10)
+            index.add(*row)
+            rows.append(row)
+    by_server = {}
+    for row in rows:
+        by_server.setdefault(row[0], []).append(row[1:])
+    return index, by_server
+
+def scan(by_server, server_id, ticker, signal_type, exchange):
+    found = set()
+    for pattern, sub_signal, sub_exchange, channel_id in by_server.get(server_id, ()):
+        if pattern.endswith(ANY):
+            if not ticker.startswith(pattern[:-1]):
+                continue
+        elif pattern != ticker:
+            continue
+        if sub_signal != ANY and sub_signal != signal_type:
+            continue
+        if sub_exchange != ANY and sub_exchange != exchange:
+            continue
+        found.add(channel_id)
+    return found
+
+def main():
+    patterns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    index, by_server = build(patterns)
+    rng = random.Random(2)
+    alerts = [(rng.randrange(SERVERS), f"T{rng.randrange(patterns)}USD", rng.choice(SIGNALS[:3]), rng.choice(EXCHANGES[1:]))
+              for _ in range(lookups)]
+
+    for alert in alerts[:1000]:
+        assert index.match(*alert) == scan(by_server, *alert)
+
+    start = time.perf_counter()
+    for alert in alerts:
+        scan(by_server, *alert)
+    linear = (time.perf_counter() - start) / lookups
+    start = time.perf_counter()
+    for alert in alerts:
+        index.match(*alert)
+    indexed = (time.perf_counter() - start) / lookups
+
+    print(f"{SERVERS} servers x {patterns} patterns, {lookups} lookups")
+    print(f"scan patterns:      {linear * 1e6:.2f} us/alert")
+    print(f"subscription index: {indexed * 1e6:.2f} us/alert ({linear / indexed:.1f}x)")
+
+if __name__ == "__main__":
+    main()
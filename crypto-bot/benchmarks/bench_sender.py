@@ -0,0 +1,70 @@
+# SendScheduler against a local fake of Discord's message endpoint, which enforces a per-channel
+# rate limit and answers over-limit sends with a 429-style retry_after, like discord.RateLimited.
+# Time is scaled down (5 messages per PER seconds) so a run takes seconds, not minutes.
+# Every seventh alert carries a long description, so batches also hit the per-message text limit.
+# Run from crypto-bot/: python -m benchmarks.bench_sender [alerts] [channels]
+import asyncio
+import sys
+import time
+from discord import Embed
+from sender import SendScheduler
+
+PER = 0.5
+HTTP_LATENCY = 0.02
+
+class FakeRateLimited(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Too many requests. Retry in {retry_after:.2f} seconds.")
+
+class FakeChannel:
+    def __init__(self, channel_id, rate=5, per=PER):
+        self.id = channel_id
+        self.rate = rate
+        self.per = per
+        self.sent_at = []
+        self.received = []
+        self.rejected = 0
+
+    async def send(self, embeds):
+        await asyncio.sleep(HTTP_LATENCY)
+        now = time.monotonic()
+        self.sent_at = [t for t in self.sent_at if now - t < self.per]
+        if len(self.sent_at) >= self.rate:
+            self.rejected += 1
+            raise FakeRateLimited(self.per - (now - self.sent_at[0]))
+        if len(embeds) > 10:
+            raise ValueError("Discord allows at most 10 embeds per message")
+        if sum(len(embed) for embed in embeds) > 6000:
+            raise ValueError("Discord allows at most 6000 characters of embed text per message")
+        self.sent_at.append(now)
+        self.received.extend(int(embed.title) for embed in embeds)
+
+def alert_embed(n):
+    return Embed(title=str(n), description="x" * (4000 if n % 7 == 0 else 200))
+
+async def run(max_embeds, alerts, channel_count):
+    channels = [FakeChannel(i) for i in range(channel_count)]
+    # Deliberately looser than the fake's limit, so the retry_after path is exercised too
+    scheduler = SendScheduler(channel_rate=8, channel_per=PER, global_rate=500, global_per=1, max_embeds=max_embeds)
+    start = time.perf_counter()
+    futures = [await scheduler.submit(channels[i % channel_count], alert_embed(i)) for i in range(alerts)]
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    in_order = all(c.received == sorted(c.received) for c in channels)
+    return elapsed, scheduler.stats(), sum(c.rejected for c in channels), in_order
+
+async def main():
+    alerts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    channel_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"{alerts} alerts over {channel_count} channels, 5 messages per {PER}s per channel")
+    print(f"{'embeds/msg':>10} {'seconds':>8} {'alerts/s':>9} {'messages':>9} {'ratio':>6} {'avg ms':>8} {'max ms':>8} {'429s':>5} {'ordered':>8}")
+    for max_embeds in (1, 10):
+        elapsed, stats, rejected, in_order = await run(max_embeds, alerts, channel_count)
+        print(f"{max_embeds:>10} {elapsed:>8.2f} {alerts / elapsed:>9.1f} {stats['messages']:>9} "
+              f"{stats['coalescing_ratio']:>6.2f} {stats['avg_latency_seconds'] * 1000:>8.1f} "
+              f"{stats['max_latency_seconds'] * 1000:>8.1f} {rejected:>5} {str(in_order):>8}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+# Cold start: time from a fresh process to its first accepted webhook and first delivered alert.
+# Each measurement runs in a new interpreter that imports main, runs the app lifespan and posts
+# an alert until it is accepted. Postgres and the Discord gateway are simulated with fixed
+# latencies (connecting the pool, each schema statement, the gateway handshake), so no database
+# or bot token is needed.
+# Run from crypto-bot/: python -m benchmarks.bench_startup [runs] [pool_ms] [ddl_ms] [gateway_ms]
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER_ID = 4242
+CHANNEL_ID = 99
+
+async def child(pool_ms, ddl_ms, gateway_ms):
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    import httpx
+    import db
+    import routing
+
+    connected = asyncio.Event()
+    delivered = asyncio.Event()
+
+    async def fake_open(wait=False, timeout=30.0):
+        async def connect():
+            await asyncio.sleep(pool_ms / 1000)
+            connected.set()
+        asyncio.create_task(connect())
+        if wait:
+            await connected.wait()
+
+    async def fake_wait(timeout=30.0):
+        await connected.wait()
+
+    class Copy:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            pass
+
+        async def write_row(self, row):
+            pass
+
+    class Cursor:
+        rows = []
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            pass
+
+        async def execute(self, query, params=None, prepare=None):
+            # Schema statements are the slow ones at startup
+            ddl = any(word in query for word in ("CREATE", "ALTER", "DROP"))
+            await asyncio.sleep((ddl_ms if ddl else 1) / 1000)
+            self.rows = []
+            if query == routing.LOAD_QUERY:
+                self.rows = [(SERVER_ID, CHANNEL_ID, 'BTCUSD', 'NONE', '*')]
+            elif "alerts_on" in query:
+                self.rows = [(True, None, 0, None)]
+
+        async def fetchone(self):
+            return self.rows[0] if self.rows else None
+
+        async def fetchall(self):
+            return self.rows
+
+        def copy(self, statement):
+            return Copy()
+
+    class Connection:
+        async def __aenter__(self):
+            await connected.wait()
+            return self
+
+        async def __aexit__(self, *exc):
+            pass
+
+        def cursor(self):
+            return Cursor()
+
+        async def commit(self):
+            pass
+
+    db.pool.open = fake_open
+    db.pool.wait = fake_wait
+    db.pool.connection = Connection
+    db.pool.get_stats = lambda: {"pool_size": 1}
+    db.pool.close = lambda: asyncio.sleep(0)
+
+    if main.delivery is not None:
+        bot = main.delivery
+
+        async def fake_start(token):
+            await asyncio.sleep(gateway_ms / 1000)
+            bot.gateway.up()
+            await asyncio.Event().wait()
+
+        class Channel:
+            id = CHANNEL_ID
+            name = "bench"
+
+            async def send(self, embed=None, embeds=None):
+                delivered.set()
+
+        async def fake_close():
+            pass
+
+        bot.bot.start = fake_start
+        bot.bot.close = fake_close
+        bot.bot.get_channel = lambda channel_id: Channel()
+
+    alert = {"server_id": SERVER_ID, "ticker": "BTCUSD", "alert": "cold start", "close": 1}
+    result = {"import_ms": (imported - started) * 1000}
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+            while True:
+                response = await client.post("/webhook", json=alert)
+                if response.status_code == 200:
+                    break
+                await asyncio.sleep(0.001)
+            result["first_accepted_ms"] = (time.perf_counter() - started) * 1000
+            if main.delivery is not None:
+                await asyncio.wait_for(delivered.wait(), 30)
+                result["first_delivered_ms"] = (time.perf_counter() - started) * 1000
+    print(json.dumps(result))
+
+def measure(role, args):
+    env = dict(os.environ, ROLE=role, DISCORD_TOKEN="bench", HISTORY_ENABLED="false", DEDUP_ENABLED="false",
+               MARKET_STATE_ENABLED="false", LOG_FILE="", LOG_LEVEL="CRITICAL")
+    out = subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--child", *args],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        asyncio.run(child(*(float(a) for a in sys.argv[2:5])))
+        return
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    args = sys.argv[2:5] or ["300", "50", "1500"]
+    pool_ms, ddl_ms, gateway_ms = args + ["300", "50", "1500"][len(args):]
+    print(f"{runs} cold starts each, simulated pool connect {pool_ms} ms, {ddl_ms} ms per schema statement, gateway handshake {gateway_ms} ms")
+    for role in ("all", "ingest"):
+        results = [measure(role, [pool_ms, ddl_ms, gateway_ms]) for _ in range(runs)]
+        line = f"ROLE={role:6}"
+        for key in ("import_ms", "first_accepted_ms", "first_delivered_ms"):
+            values = [r[key] for r in results if key in r]
+            if values:
+                line += f"  {key} {statistics.median(values):7.0f}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
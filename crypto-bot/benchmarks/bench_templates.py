@@ -0,0 +1,102 @@
+# Per-alert embed rendering: the inline embed code bot.py used before templates, against the
+# compiled default template (which produces the same embed) and a custom template using fewer fields.
+# Run from crypto-bot/: python -m benchmarks.bench_templates [alerts]
+# Compiling a template generates and compiles a Python function, so it is timed separately
+import random
+import sys
+import time
+from datetime import datetime
+from discord import Embed
+from models import Alert
+import templates
+
+CUSTOM = """title: {ticker} {signal}
+description: {alert}
+color: #3498db
+line: Price | {close} ({change})
+footer: {exchange} {interval}"""
+
+def inline_embed(alert, signal_type, state):
+    embed = Embed(
+        title=f"🚨 Alert: {alert.ticker}",
+        description=alert.alert,
+        color=0x00b05e
+    )
+    # Optional fields
+    for field in ['signal_type', 'exchange', 'time', 'interval', 'high', 'low', 'open', 'close']:
+        value = getattr(alert, field)
+        if value is not None:
+            name = field.capitalize()
+            if field == 'time':
+                try:
+                    value = datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M UTC')
+                except Exception:
+                    pass
+            if field == 'signal_type':
+                if signal_type == 'NONE':
+                    continue
+                else:
+                    name = 'Advanced Signal'
+                    value = signal_type
+            embed.add_field(name=name, value=value, inline=True)
+    if state is not None:
+        change, low, high, per_hour, samples = state
+        if change is not None:
+            embed.add_field(name="Change", value=f"{change:+.2f}% since last alert", inline=True)
+        embed.add_field(name="Range", value=f"{low:g} - {high:g} (last {samples})", inline=True)
+        if per_hour is not None:
+            embed.add_field(name="Frequency", value=f"{per_hour:.1f} alerts/h", inline=True)
+
+    embed.set_footer(text="Source: TradingView webhooks")
+    return embed
+
+def make_alerts(count):
+    rng = random.Random(3)
+    alerts = []
+    for n in range(count):
+        close = 29000 + rng.random() * 1000
+        data = {"server_id": 1, "ticker": rng.choice(["BTCUSD", "ETHUSD", "SOLUSD"]), "alert": f"alert {n}",
+                "time": f"2025-07-28T15:{n % 60:02d}:00Z", "open": close - 50, "close": close, "high": close + 80,
+                "low": close - 90, "interval": "1h", "exchange": "BINANCE"}
+        signal_type = rng.choice(["NONE", "NONE", "BUY"])
+        if signal_type != "NONE":
+            data["signal_type"] = signal_type
+        state = rng.choice([None, (0.5, close - 200, close + 200, 4.0, 12), (None, close, close, None, 1)])
+        alerts.append((Alert.from_dict(data), signal_type, state))
+    return alerts
+
+# Best of several passes, per alert
+def timed(render, alerts, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for alert, signal_type, state in alerts:
+            render(alert, signal_type, state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(alerts)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    alerts = make_alerts(count)
+    default = templates.get()
+    custom = templates.get(CUSTOM)
+    for alert, signal_type, state in alerts[:500]:
+        assert inline_embed(alert, signal_type, state).to_dict() == default.render(alert, signal_type, state).to_dict()
+
+    inline = timed(inline_embed, alerts)
+    compiled = timed(default.render, alerts)
+    smaller = timed(custom.render, alerts)
+    start = time.perf_counter()
+    for _ in range(1000):
+        templates.Template(templates.DEFAULT_TEMPLATE)
+    compile_us = (time.perf_counter() - start) / 1000 * 1e6
+
+    print(f"{count} alerts")
+    print(f"inline embed code: {inline * 1e6:6.1f} us/alert")
+    print(f"default template:  {compiled * 1e6:6.1f} us/alert ({inline / compiled:.2f}x)")
+    print(f"custom template:   {smaller * 1e6:6.1f} us/alert ({inline / smaller:.2f}x)")
+    print(f"compiling a template: {compile_us:.0f} us, once per template source")
+
+if __name__ == "__main__":
+    main()
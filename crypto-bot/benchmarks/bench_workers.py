@@ -0,0 +1,47 @@
+# Alerts/sec through the Dispatcher as the worker count grows.
+# Sends are simulated with a delay that differs per ticker (like a cache miss on one of them), and
+# every server's tickers share one channel, so per-channel order is checked across tickers.
+# This measures dispatch concurrency, not Discord.
+# Run from crypto-bot/: python -m benchmarks.bench_workers [alerts] [servers] [send_ms]
+import asyncio
+import sys
+import time
+from dispatch import Dispatcher
+from models import Alert
+
+TICKERS = 4
+
+async def run(workers, alerts, servers, send_delay):
+    source = asyncio.Queue()
+    delivered = {}
+
+    async def handler(alert):
+        await asyncio.sleep(send_delay * (1 + int(alert.ticker[1:]) % 3))
+        # One channel per server, subscribed to all its tickers
+        delivered.setdefault(alert.server_id, []).append(int(alert.alert))
+
+    dispatcher = Dispatcher(source, handler, workers=workers)
+    dispatcher.start()
+    start = time.perf_counter()
+    for seq in range(alerts):
+        source.put_nowait(Alert.from_dict({'server_id': seq % servers, 'ticker': f"T{seq // servers % TICKERS}", 'alert': str(seq)}))
+    await source.join()
+    elapsed = time.perf_counter() - start
+    await dispatcher.stop()
+
+    in_order = all(seqs == sorted(seqs) for seqs in delivered.values())
+    return alerts / elapsed, in_order
+
+async def main():
+    alerts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    servers = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    send_delay = (float(sys.argv[3]) if len(sys.argv) > 3 else 5) / 1000
+
+    print(f"{alerts} alerts over {servers} servers ({TICKERS} tickers sharing each server's channel), {send_delay * 1000:.1f} ms base send")
+    print(f"{'workers':>8} {'alerts/sec':>12} {'ordered':>8}")
+    for workers in (1, 2, 4, 8, 16, 32):
+        rate, in_order = await run(workers, alerts, servers, send_delay)
+        print(f"{workers:>8} {rate:>12.1f} {str(in_order):>8}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
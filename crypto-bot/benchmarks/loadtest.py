@@ -0,0 +1,283 @@
+# Offline end-to-end load test. Runs the FastAPI app in-process with an in-memory stand-in for
+# db.pool and fake Discord channels in place of the gateway, drives /webhook at a target rate
+# with a seeded alert mix, and reports throughput, end-to-end latency and memory.
+#
+# Run from crypto-bot/:
+#   python -m benchmarks.loadtest --rate 500 --duration 10 --out run.json
+#   python -m benchmarks.loadtest --rate 500 --duration 10 --compare run.json
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("QUEUE_MAX_SIZE", "1000000")
+os.environ.setdefault("WEBHOOK_RATE", "0")
+os.environ["OUTBOX_ENABLED"] = "false"
+os.environ["DEDUP_ENABLED"] = "false"
+os.environ["HISTORY_ENABLED"] = "false"
+
+import httpx
+import bot
+import routing
+import shared
+from main import app
+from sender import TokenBucket
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=200, help="target alerts per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--tickers", type=int, default=200)
+    parser.add_argument("--hot-tickers", type=int, default=5, help="tickers receiving --hot-share of the alerts")
+    parser.add_argument("--hot-share", type=float, default=0.5)
+    parser.add_argument("--advanced-share", type=float, default=0.3, help="share of alerts with a signal_type")
+    parser.add_argument("--secret-share", type=float, default=0.3, help="share of guilds with a secret set")
+    parser.add_argument("--bad-secret-share", type=float, default=0.02, help="share of alerts with a wrong secret")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--send-latency-ms", type=float, default=50.0)
+    parser.add_argument("--channel-rate", type=int, default=None, help="override the per-channel send rate (messages per --channel-per)")
+    parser.add_argument("--channel-per", type=float, default=None)
+    parser.add_argument("--global-rate", type=int, default=None, help="override the global send rate (messages per second)")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slows the run down)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--concurrency", type=int, default=64, help="max in-flight webhook requests")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression before failing --compare")
+    return parser.parse_args()
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, query, params=None, prepare=None):
+        await asyncio.sleep(self.db.latency)
+        self.db.queries += 1
+        if query == bot.SERVER_QUERY:
+            self.result = self.db.servers.get(params[0])
+        elif query == routing.LOAD_QUERY:
+            self.result = self.db.channels
+        else:
+            self.result = None
+
+    async def fetchone(self):
+        return self.result
+
+    async def fetchall(self):
+        return list(self.result or [])
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    async def commit(self):
+        pass
+
+# Stand-in for db.pool holding the servers and channels tables in dicts
+class FakePool:
+    def __init__(self, latency):
+        self.latency = latency
+        self.queries = 0
+        self.servers = {}
+        self.channels = []
+
+    def connection(self):
+        return FakeConnection(self)
+
+    def get_stats(self):
+        return {"queries": self.queries}
+
+class FakeChannel:
+    def __init__(self, channel_id, latency, delivered):
+        self.id = channel_id
+        self.name = f"fake-{channel_id}"
+        self.latency = latency
+        self.delivered = delivered
+
+    async def send(self, embed=None, embeds=None):
+        await asyncio.sleep(self.latency)
+        now = time.time()
+        for e in embeds or [embed]:
+            self.delivered[e.description] = now
+
+
+def build_world(args, rng, db, delivered):
+    guilds = [1000 + g for g in range(args.guilds)]
+    tickers = [f"T{t}USD" for t in range(args.tickers)]
+    secrets = {}
+    channels = {}
+    for g in guilds:
+        secret = f"s{g}" if rng.random() < args.secret_share else None
+        secrets[g] = secret
+        db.servers[g] = (True, secret, 0, None)
+        for i, ticker in enumerate(tickers):
+            channel_id = g * 100 + i % 10
+            channels.setdefault(channel_id, FakeChannel(channel_id, args.send_latency_ms / 1000, delivered))
+            db.channels.append((g, channel_id, ticker, 'NONE', '*'))
+            db.channels.append((g, channel_id, ticker, 'BUY', '*'))
+    return guilds, tickers, secrets, channels
+
+def make_alerts(args, rng, guilds, tickers, secrets):
+    hot = tickers[:args.hot_tickers]
+    count = int(args.rate * args.duration)
+    alerts = []
+    for n in range(count):
+        guild = rng.choice(guilds)
+        ticker = rng.choice(hot) if rng.random() < args.hot_share else rng.choice(tickers)
+        alert = {
+            "server_id": guild,
+            "ticker": ticker,
+            "alert": f"lt-{n}",
+            "time": "2025-07-28T15:34:00Z",
+            "open": 29500, "close": 29600, "high": 29700, "low": 29400,
+            "interval": "1h",
+            "exchange": "BINANCE",
+        }
+        if rng.random() < args.advanced_share:
+            alert["signal_type"] = "buy"
+        if secrets[guild] is not None:
+            alert["secret"] = "wrong" if rng.random() < args.bad_secret_share else secrets[guild]
+        alerts.append(alert)
+    return alerts
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run(args):
+    rng = random.Random(args.seed)
+    db = FakePool(args.db_latency_ms / 1000)
+    delivered = {}
+    guilds, tickers, secrets, channels = build_world(args, rng, db, delivered)
+    alerts = make_alerts(args, rng, guilds, tickers, secrets)
+    expected = sum(1 for a in alerts if a.get("secret") != "wrong")
+
+    bot.pool = db
+    shared.pool = db
+    routing.pool = db
+    await routing.subscriptions.load()
+    bot.bot.get_channel = channels.get
+    if args.channel_rate is not None:
+        bot.sender.channel_rate = args.channel_rate
+    if args.channel_per is not None:
+        bot.sender.channel_per = args.channel_per
+    if args.global_rate is not None:
+        bot.sender.global_bucket = TokenBucket(args.global_rate, 1)
+    logging.getLogger().setLevel(args.log_level)
+    bot.gateway.up()
+    bot.supervisor.start()
+
+    sent_at = {}
+    limit = asyncio.Semaphore(args.concurrency)
+    if args.tracemalloc:
+        tracemalloc.start()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        async def post(alert):
+            async with limit:
+                sent_at[alert["alert"]] = time.time()
+                response = await client.post('/webhook', json=alert)
+                if response.status_code != 200:
+                    raise RuntimeError(f"webhook returned {response.status_code}: {response.text}")
+
+        start = time.perf_counter()
+        tasks = []
+        for n, alert in enumerate(alerts):
+            # Open-loop pacing: request n is issued at n / rate seconds
+            delay = start + n / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(alert)))
+        await asyncio.gather(*tasks)
+        ingest_elapsed = time.perf_counter() - start
+
+        deadline = time.perf_counter() + 60
+        while len(delivered) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+    peak = None
+    if args.tracemalloc:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    await bot.supervisor.stop()
+    await bot.sender.close()
+
+    latencies = [delivered[k] - sent_at[k] for k in delivered if k in sent_at]
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "tolerance", "log_level")},
+        "alerts": len(alerts),
+        "expected_deliveries": expected,
+        "delivered": len(delivered),
+        "ingest_rate": round(len(alerts) / ingest_elapsed, 1),
+        "throughput": round(len(delivered) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+        },
+        "db_queries": db.queries,
+        "sender": bot.sender.stats(),
+        "tracemalloc_peak_mb": None if peak is None else round(peak / 1e6, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+# Fails when throughput drops, or p99 latency or peak RSS grow, by more than the tolerance
+def compare(result, baseline, tolerance):
+    checks = [
+        ("throughput", result["throughput"], baseline["throughput"], False),
+        ("p99 latency ms", result["latency_ms"]["p99"], baseline["latency_ms"]["p99"], True),
+        ("max rss mb", result["max_rss_mb"], baseline["max_rss_mb"], True),
+    ]
+    failed = False
+    for name, now, before, lower_is_better in checks:
+        change = (now - before) / before if before else 0.0
+        regressed = change > tolerance if lower_is_better else change < -tolerance
+        failed |= regressed
+        print(f"{name:>20}: {before:>10} -> {now:>10} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return not failed
+
+def main():
+    args = parse_args()
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["config"] != result["config"]:
+            print("warning: baseline was run with a different configuration")
+        if not compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
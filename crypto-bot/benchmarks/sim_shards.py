@@ -0,0 +1,128 @@
+# Sharded delivery simulation. Runs the bot as an AutoShardedBot with SHARD_COUNT local shards,
+# but fake gateway clients instead of Discord connections: each shard comes up after its own
+# handshake delay and one shard drops out for a while mid-run. Alerts for snowflake guild ids are
+# queued at a steady rate, and the harness checks that every alert is handled by the dispatcher
+# of the shard owning its guild, and that an outage only delays that shard's alerts.
+# Uses the in-memory database and channel stand-ins from loadtest.py.
+# Run from crypto-bot/: python -m benchmarks.sim_shards [shards] [guilds] [alerts/s] [seconds]
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+SHARDS = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+os.environ["SHARD_COUNT"] = str(SHARDS)
+os.environ.pop("SHARD_IDS", None)
+os.environ["MARKET_STATE_ENABLED"] = "false"
+
+from benchmarks.loadtest import FakePool, FakeChannel, percentile
+import bot
+import routing
+import shared
+from models import Alert
+from shards import shard_for
+
+DISCORD_EPOCH_MS = 1420070400000
+
+def snowflake(rng):
+    created = rng.randrange(1_500_000_000_000, 1_750_000_000_000) - DISCORD_EPOCH_MS
+    return (created << 22) | rng.getrandbits(22)
+
+# Stands in for one shard's gateway websocket: identify after a handshake delay, optionally drop
+# the connection and resume later. Calls the same event handlers discord.py dispatches for a real
+# shard; the unconnected client has no loop to dispatch them on itself
+class FakeGatewayClient:
+    def __init__(self, shard_id, handshake, outage=None):
+        self.shard_id = shard_id
+        self.handshake = handshake
+        self.outage = outage
+
+    async def run(self):
+        await asyncio.sleep(self.handshake)
+        await bot.on_shard_ready(self.shard_id)
+        if self.outage is not None:
+            start, length = self.outage
+            await asyncio.sleep(start - self.handshake)
+            await bot.on_shard_disconnect(self.shard_id)
+            await asyncio.sleep(length)
+            await bot.on_shard_resumed(self.shard_id)
+
+async def run(guild_count, rate, duration):
+    rng = random.Random(7)
+    db = FakePool(0.0005)
+    delivered = {}
+    guilds = [snowflake(rng) for _ in range(guild_count)]
+    channels = {}
+    for guild in guilds:
+        db.servers[guild] = (True, None, 0, None)
+        channels[guild] = FakeChannel(guild, 0.002, delivered)
+        db.channels.append((guild, guild, 'BTCUSD', 'NONE', '*'))
+    bot.pool = shared.pool = routing.pool = db
+    await routing.subscriptions.load()
+    bot.bot.get_channel = channels.get
+    bot.sender.channel_rate = 1000
+    bot.sender.global_bucket.capacity = bot.sender.global_bucket.tokens = 100000
+    bot.sender.global_bucket.fill_rate = 100000
+    logging.getLogger().setLevel(logging.ERROR)
+
+    # Every alert must be handled by its guild's shard
+    handled_by = {}
+    def checked(shard_id, handler):
+        async def handle(alert):
+            handled_by[alert.alert] = shard_id
+            await handler(alert)
+        return handle
+    for shard_id, dispatcher in bot.dispatchers.items():
+        dispatcher.handler = checked(shard_id, dispatcher.handler)
+
+    outage_shard = SHARDS - 1 if SHARDS > 1 else None
+    outage = (duration * 0.3, duration * 0.3)
+    clients = [FakeGatewayClient(s, 0.05 * (s + 1), outage if s == outage_shard else None) for s in range(SHARDS)]
+    gateway_tasks = [asyncio.create_task(c.run()) for c in clients]
+    bot.supervisor.start()
+
+    sent_at = {}
+    shard_of = {}
+    start = time.perf_counter()
+    count = int(rate * duration)
+    for n in range(count):
+        delay = start + n / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        guild = rng.choice(guilds)
+        name = f"sim-{n}"
+        sent_at[name] = time.time()
+        shard_of[name] = shard_for(guild)
+        shared.queue.put_nowait(Alert.from_dict({"server_id": guild, "ticker": "BTCUSD", "alert": name}, time.time()))
+    deadline = time.perf_counter() + 30
+    while len(delivered) < count and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    stats = bot.shard_stats()
+    for task in gateway_tasks:
+        task.cancel()
+    await bot.supervisor.stop()
+    await bot.sender.close()
+
+    print(f"{SHARDS} shards, {guild_count} guilds, {count} alerts over {duration:.0f}s; "
+          f"shard {outage_shard} offline from {outage[0]:.1f}s for {outage[1]:.1f}s")
+    print(f"{'shard':>5} {'alerts':>7} {'delivered':>9} {'wrong shard':>11} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'disconnects':>11}")
+    for shard_id in range(SHARDS):
+        names = [n for n, s in shard_of.items() if s == shard_id]
+        latencies = [delivered[n] - sent_at[n] for n in names if n in delivered]
+        wrong = sum(1 for n in names if n in handled_by and handled_by[n] != shard_id)
+        print(f"{shard_id:>5} {len(names):>7} {len(latencies):>9} {wrong:>11} "
+              f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+              f"{max(latencies, default=0) * 1000:>8.1f} {stats[str(shard_id)]['disconnects']:>11}")
+    if len(delivered) < count or any(handled_by[n] != s for n, s in shard_of.items() if n in handled_by):
+        sys.exit(1)
+
+def main():
+    guild_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 500
+    duration = float(sys.argv[4]) if len(sys.argv) > 4 else 4
+    asyncio.run(run(guild_count, rate, duration))
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import discord
 import psycopg
 import psycopg_pool
@@ -7,12 +8,26 @@ import hmac
 from discord.ext import commands
 from discord import Embed
 from dotenv import load_dotenv
-from shared import queue, logger
-from shared import get_prefix, toggle_alerts, set_channel, set_secret, get_secret
+from shared import queue, logger, trace
+from shared import get_prefix, load_prefixes, cache_prefix, invalidate_prefix, toggle_alerts, set_channel, set_secret, get_secret, set_digest_window, set_webhook_rate, set_template, get_template
 from db import pool
-from datetime import datetime
-import traceback
+from dispatch import Dispatcher, ALERT_WORKERS
+from metrics import stage_seconds, alerts_total
+from sender import SendScheduler
+from supervisor import Supervisor
+import outbox
+import history
+import market
+import templates
+from digest import Coalescer, DIGEST_MAX_WINDOW
+from logs import begin_alert, end_alert
+from models import Alert
+from cache import server_cache, invalidate_server, MISSING
+from routing import subscriptions, ANY
+from ratelimit import limiter, WEBHOOK_RATE_MAX
+from shards import GatewayState, ShardRouter, shard_for, SHARDED, SHARD_COUNT, SHARD_IDS
 import math
+import time
 
 load_dotenv()
 
@@ -20,39 +35,96 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix=get_prefix, intents=intents, help_command=None)
+# Long rate limits raise RateLimited instead of sleeping inside send, the SendScheduler retries them.
+# Nothing reads the member list, so guilds are not chunked at startup and members are not cached
+options = dict(command_prefix=get_prefix, intents=intents, help_command=None, max_ratelimit_timeout=30.0,
+               chunk_guilds_at_startup=False, member_cache_flags=discord.MemberCacheFlags.none())
+if SHARDED:
+    bot = commands.AutoShardedBot(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **options)
+else:
+    bot = commands.Bot(**options)
+sender = SendScheduler()
+# Which shards are connected, alert consumers wait on their guild's shard instead of failing sends
+gateway = GatewayState()
 
 @bot.event
 async def on_ready():
     logger.info(f"We are ready to go in, {bot.user.name}")
+    if not SHARDED:
+        gateway.up(0)
 
-    try:
-        logger.info("Connected to PostgreSQL")
-        async with pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute('''--begin-sql
-                        CREATE TABLE IF NOT EXISTS servers (
-                        server_id BIGINT PRIMARY KEY, 
-                        alerts_on BOOLEAN DEFAULT TRUE,
-                        prefix VARCHAR(10) DEFAULT '!',
-                        secret TEXT
-                        );
-        ''')
-                await cur.execute('''--begin-sql
-                        CREATE TABLE IF NOT EXISTS channels (
-                        id SERIAL PRIMARY KEY,
-                        channel_id BIGINT,
-                        server_id BIGINT, 
-                        ticker VARCHAR(50),
-                        signal_type VARCHAR(50) DEFAULT 'NONE',
-                        UNIQUE (server_id, ticker, signal_type)
-                        );
-        ''')
-            await conn.commit()
-        bot.loop.create_task(alert_request())
-    except Exception as e:
-        logger.error(f"DB initialization error: {e}")
-        return
+@bot.event
+async def on_resumed():
+    if not SHARDED:
+        gateway.up(0)
+
+@bot.event
+async def on_disconnect():
+    if not SHARDED:
+        gateway.down(0)
+
+# Only dispatched by AutoShardedBot
+@bot.event
+async def on_shard_ready(shard_id):
+    logger.info(f"Shard {shard_id} of {SHARD_COUNT} is ready.")
+    gateway.up(shard_id)
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    gateway.up(shard_id)
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    gateway.down(shard_id)
+
+# Run once at startup from main.lifespan, not from on_ready, which fires again after every reconnect
+async def init_schema():
+    logger.info("Connected to PostgreSQL")
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute('''--begin-sql
+                    CREATE TABLE IF NOT EXISTS servers (
+                    server_id BIGINT PRIMARY KEY, 
+                    alerts_on BOOLEAN DEFAULT TRUE,
+                    prefix VARCHAR(10) DEFAULT '!',
+                    secret TEXT
+                    );
+    ''')
+            await cur.execute('''--begin-sql
+                    CREATE TABLE IF NOT EXISTS channels (
+                    id SERIAL PRIMARY KEY,
+                    channel_id BIGINT,
+                    server_id BIGINT, 
+                    ticker VARCHAR(50),
+                    signal_type VARCHAR(50) DEFAULT 'NONE',
+                    exchange VARCHAR(50) NOT NULL DEFAULT '*'
+                    );
+    ''')
+            # Several channels per (ticker, signal) for fan-out: the old one-destination UNIQUE
+            # constraint is replaced by one that includes the exchange and the channel
+            await cur.execute("ALTER TABLE channels ADD COLUMN IF NOT EXISTS exchange VARCHAR(50) NOT NULL DEFAULT '*';")
+            await cur.execute("ALTER TABLE channels DROP CONSTRAINT IF EXISTS channels_server_id_ticker_signal_type_key;")
+            await cur.execute('''--begin-sql
+                    CREATE UNIQUE INDEX IF NOT EXISTS channels_subscription_key
+                    ON channels (server_id, ticker, signal_type, exchange, channel_id);
+    ''')
+            # Seconds to fold repeat alerts per (ticker, signal) into a digest, 0 sends every alert
+            await cur.execute("ALTER TABLE servers ADD COLUMN IF NOT EXISTS digest_window INT DEFAULT 0;")
+            await cur.execute("ALTER TABLE servers ADD COLUMN IF NOT EXISTS webhook_rate INT;")
+            await cur.execute("ALTER TABLE servers ADD COLUMN IF NOT EXISTS template TEXT;")
+            # The unique index also serves the per-server listing in !alerts; routing itself is
+            # matched in memory by the subscription index
+        await conn.commit()
+    if outbox.OUTBOX_ENABLED:
+        await outbox.init_schema()
+    if history.HISTORY_ENABLED:
+        await history.init_schema()
+    if market.MARKET_STATE_ENABLED:
+        await market.init_schema()
+    await load_prefixes()
+    count = await subscriptions.load()
+    logger.info(f"Loaded {count} channel subscriptions.")
+    await limiter.load()
 
 
 # Here either tell users to !setprefix to register the guild to start sending alerts or automatically add guild to the db!
@@ -67,6 +139,9 @@ async def on_guild_join(guild):
                             ON CONFLICT (server_id) DO NOTHING
                 ''', (guild.id, True, '!'))
                 await conn.commit()
+        invalidate_server(guild.id)
+        # Rejoining guilds keep their old row, so reload rather than assume '!'
+        invalidate_prefix(guild.id)
     except Exception as e:
         logger.error(f'DB error in on guild join: {e}')
         return
@@ -110,14 +185,14 @@ async def help(ctx):
     embed.add_field(name="Structure the alert message as a json like this", value=json, inline=False)
     embed.add_field(name="REQUIRED JSON FIELDS:",value="server_id, ticker, alert", inline=False)
     embed.add_field(name="For added security:",value="Add a secret using !setsecret, webhooks will now require the valid secret to be sent as a field", inline=False)
-    embed.add_field(name="Other commands:", value="!set channel [ticker, signal (optional)], !remove alert, !set secret [secret], !secret, !remove secret, !alerts [page number], !togglealerts, !set prefix [prefix]", inline=False)
+    embed.add_field(name="Other commands:", value="!set channel [ticker or prefix like BTC*, signal or * (optional), exchange (optional)], !remove alert [ticker, signal (optional), exchange (optional), #channel (optional)], !set secret [secret], !secret, !remove secret, !alerts [page number] [ticker] [#channel], !history [ticker] [signal], !togglealerts, !set prefix [prefix], !set digest [seconds/off], !set ratelimit [alerts per minute/default], !template, !set template [template/default]", inline=False)
 
     await ctx.send(embed=embed)
 
 @bot.group()
 async def set(ctx):
     if ctx.invoked_subcommand is None:
-        await ctx.send('Invalid set command, you can use !set [secret/prefix/channel]')
+        await ctx.send('Invalid set command, you can use !set [secret/prefix/channel/digest/ratelimit/template]')
 
 @set.command()
 @commands.has_permissions(administrator=True)
@@ -126,24 +201,35 @@ async def secret(ctx, secret=None):
         await ctx.send("Make sure to specify a secret password for the server, one that will be required in the json if set")
         return
     await set_secret(ctx.guild.id, secret)
+    limiter.set_secret(ctx.guild.id, secret)
     await ctx.send("🗝️ Server password set. You must now include the secret property and set the value to the appropriate secret password. !remove secret to remove secret")
 
 @set.command()
 @commands.has_permissions(administrator=True)
-async def channel(ctx, ticker=None, signal=None):
+async def channel(ctx, ticker=None, signal=None, exchange=None):
     if not ticker:
-        await ctx.send("❌ Incorrect usage, specify ticker of active TradingView alert to add: e.g. !set channel BTCUSD")
+        await ctx.send("❌ Incorrect usage, specify ticker of active TradingView alert to add: e.g. !set channel BTCUSD, !set channel BTC* * BINANCE")
+        return
+    if ANY in ticker[:-1]:
+        await ctx.send("❌ ERROR: * is only supported at the end of a ticker, e.g. BTC* or *")
         return
 
     server_id = ctx.guild.id
     channel_id = ctx.channel.id
-    
-    await set_channel(server_id, channel_id, ticker, signal)
-    
-    if signal is None:
-        await ctx.send(ticker.upper() + " alerts will now be sent here in #" + ctx.channel.name)
-    else: 
-        await ctx.send("Advanced signal " + signal.upper() + " for coin " + ticker.upper() + " will now be sent here in #" + ctx.channel.name)
+    ticker = ticker.upper()
+    signal_type = 'NONE' if signal is None else signal.upper()
+    exchange = ANY if exchange is None else exchange.upper()
+
+    await set_channel(server_id, channel_id, ticker, signal, exchange)
+    subscriptions.add(server_id, ticker, signal_type, exchange, channel_id)
+
+    on_exchange = "" if exchange == ANY else f" on {exchange}"
+    if signal_type == 'NONE':
+        await ctx.send(ticker + on_exchange + " alerts will now be sent here in #" + ctx.channel.name)
+    elif signal_type == ANY:
+        await ctx.send("All alerts and signals for " + ticker + on_exchange + " will now be sent here in #" + ctx.channel.name)
+    else:
+        await ctx.send("Advanced signal " + signal_type + " for coin " + ticker + on_exchange + " will now be sent here in #" + ctx.channel.name)
 
 @set.command()
 @commands.has_permissions(administrator=True)
@@ -165,12 +251,70 @@ async def prefix(ctx, new_prefix):
                             SET prefix = EXCLUDED.prefix;
                 ''', (ctx.guild.id, True, new_prefix))
                 await conn.commit()
+            invalidate_server(ctx.guild.id)
+            cache_prefix(ctx.guild.id, new_prefix)
 
             await ctx.send(f"Prefix for this server set to {new_prefix}")
     except Exception as e:
         logger.error(f"DB error in setprefix: {e}")
         return
 
+@set.command()
+@commands.has_permissions(administrator=True)
+async def digest(ctx, seconds=None):
+    if seconds is None:
+        await ctx.send(f"❌ Incorrect usage, specify a window in seconds or off: e.g. !set digest 60 (max {DIGEST_MAX_WINDOW})")
+        return
+    if seconds.lower() in ('off', '0'):
+        window = 0
+    elif seconds.isdigit() and 0 < int(seconds) <= DIGEST_MAX_WINDOW:
+        window = int(seconds)
+    else:
+        await ctx.send(f"❌ ERROR: Digest window must be between 1 and {DIGEST_MAX_WINDOW} seconds, or off.")
+        return
+    await set_digest_window(ctx.guild.id, window)
+    if window:
+        await ctx.send(f"Repeat alerts for the same ticker and signal within {window}s will now be grouped into a digest.")
+    else:
+        await ctx.send("Alert digests turned OFF, every alert will be sent.")
+
+@set.command()
+@commands.has_permissions(administrator=True)
+async def ratelimit(ctx, per_minute=None):
+    if per_minute is None:
+        await ctx.send(f"Webhook alerts for this server are limited to {limiter.rate_for(ctx.guild.id)} per minute. Change it with e.g. !set ratelimit 60 (max {WEBHOOK_RATE_MAX}) or !set ratelimit default")
+        return
+    if per_minute.lower() == 'default':
+        rate = None
+    elif per_minute.isdigit() and 0 < int(per_minute) <= WEBHOOK_RATE_MAX:
+        rate = int(per_minute)
+    else:
+        await ctx.send(f"❌ ERROR: Rate limit must be between 1 and {WEBHOOK_RATE_MAX} alerts per minute, or default.")
+        return
+    await set_webhook_rate(ctx.guild.id, rate)
+    limiter.set(ctx.guild.id, rate)
+    await ctx.send(f"Webhook alerts for this server are now limited to {limiter.rate_for(ctx.guild.id)} per minute.")
+
+@set.command(name="template")
+@commands.has_permissions(administrator=True)
+async def set_template_command(ctx, *, text=None):
+    if text is None:
+        await ctx.send("❌ Incorrect usage, put the template after the command, one `key: text` per line, or use !set template default. !template shows the current one.")
+        return
+    text = text.strip().removeprefix('```').removesuffix('```').strip()
+    if text.lower() == 'default':
+        source = None
+    else:
+        source = text
+    # Compiled and rendered before it is saved, so a template Discord would reject never reaches alerts
+    try:
+        preview = templates.get(source).render(SAMPLE_ALERT, 'BUY', SAMPLE_STATE)
+    except templates.TemplateError as e:
+        await ctx.send(f"❌ ERROR: {e}")
+        return
+    await set_template(ctx.guild.id, source)
+    await ctx.send("Alert template updated, the next alerts will look like this:", embed=preview)
+
 @bot.group()
 async def remove(ctx):
     if ctx.invoked_subcommand is None:
@@ -180,35 +324,55 @@ async def remove(ctx):
 @commands.has_permissions(administrator=True)
 async def secret(ctx):
     await set_secret(ctx.guild.id, None)
+    limiter.set_secret(ctx.guild.id, None)
     await ctx.send("Secret removed. You now no longer need a secret to send webhooks.")
 
 @remove.command()
 @commands.has_permissions(administrator=True)
-async def alert(ctx, ticker=None, signal=None):
+async def alert(ctx, *args):
+    # !remove alert [ticker] [signal] [exchange] [#channel], the channel anywhere; without one the
+    # subscription is removed from every channel it is sent to
+    channel = None
+    rest = []
+    for arg in args:
+        if arg.startswith('<#'):
+            try:
+                channel = await commands.TextChannelConverter().convert(ctx, arg)
+            except commands.BadArgument:
+                await ctx.send(f"❌ Channel {arg} not found.")
+                return
+        else:
+            rest.append(arg)
+    ticker, signal, exchange = (rest + [None] * 3)[:3]
     if not ticker:
-        await ctx.send("❌ Incorrect usage, specify ticker of alert to remove: e.g. !remove alert BTCUSD [OPTIONAL SIGNAL TYPE]")
+        await ctx.send("❌ Incorrect usage, specify ticker of alert to remove: e.g. !remove alert BTCUSD [OPTIONAL SIGNAL TYPE] [OPTIONAL EXCHANGE] [OPTIONAL #channel]")
         return
     ticker = ticker.upper()
 
     signal_type = 'NONE' if signal is None else signal.upper()
+    exchange = ANY if exchange is None else exchange.upper()
+    channel_id = channel.id if channel is not None else None
     try:
         async with pool.connection() as conn:
             async with conn.cursor() as cur:
                 await cur.execute('''
                             DELETE FROM channels
-                            WHERE server_id = %s AND ticker = %s AND signal_type = %s
+                            WHERE server_id = %s AND ticker = %s AND signal_type = %s AND exchange = %s
+                            AND (%s::bigint IS NULL OR channel_id = %s::bigint)
                             RETURNING *;
-                ''', (ctx.guild.id, ticker, signal_type))
+                ''', (ctx.guild.id, ticker, signal_type, exchange, channel_id, channel_id))
                 deleted = await cur.fetchone()
                 await conn.commit()
+            subscriptions.remove(ctx.guild.id, ticker, signal_type, exchange, channel_id)
 
+            in_channel = "" if channel is None else f" in #{channel.name}"
             if deleted:
                 if signal_type == 'NONE':
-                    await ctx.send(f"Alert {ticker} has been removed from this server.")
+                    await ctx.send(f"Alert {ticker} has been removed{in_channel or ' from this server'}.")
                 else: 
-                    await ctx.send(f"Advanced signal {signal_type} for coin {ticker} has been removed from this server.")
+                    await ctx.send(f"Advanced signal {signal_type} for coin {ticker} has been removed{in_channel or ' from this server'}.")
             else:
-                await ctx.send(f"❌ ERROR: Alert {ticker} doesn't exist in this server.")
+                await ctx.send(f"❌ ERROR: Alert {ticker} doesn't exist{in_channel or ' in this server'}.")
     except Exception as e:
         logger.error(f"DB error in removealert: {e}")
         return
@@ -223,6 +387,19 @@ async def secret(ctx):
         await ctx.send(f"There is currently a secret for this server. If you forgot it, get an administrator to reset it and set a new one. !remove secret")
 
 
+SAMPLE_ALERT = Alert.from_dict({"server_id": 0, "ticker": "BTCUSD", "alert": "Crossing 29,500", "time": "2025-07-28T15:34:00Z",
+                                 "open": 29500, "close": 29600, "high": 29700, "low": 29400, "interval": "1h", "exchange": "BINANCE"})
+SAMPLE_STATE = (1.25, 29100.0, 29800.0, 3.5, 12)
+
+@bot.command(name="template")
+@commands.has_permissions(administrator=True)
+async def template_command(ctx):
+    source = await get_template(ctx.guild.id)
+    template = templates.get(source)
+    label = "the default template" if source is None else "this server's template"
+    await ctx.send(f"Alerts use {label}. Change it with !set template, available placeholders: {', '.join('{' + n + '}' for n in templates.VALUES)}\n```\n{template.source}\n```",
+                   embed=template.render(SAMPLE_ALERT, 'BUY', SAMPLE_STATE))
+
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def togglealerts(ctx):
@@ -232,154 +409,452 @@ async def togglealerts(ctx):
     else:
         await ctx.send("Alerts are now turned OFF.")
 
+ALERTS_PAGE_SIZE = 25
+
+# One page of a server's channel subscriptions, ordered like the channels_subscription_key index.
+# Later pages continue from the last subscription shown rather than re-scanning with OFFSET
+async def fetch_alerts(server_id, ticker=None, channel_id=None, offset=0, after=None, with_total=False):
+    conditions = ["server_id = %s"]
+    params = [server_id]
+    if ticker is not None:
+        conditions.append("ticker LIKE %s")
+        params.append(ticker.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if channel_id is not None:
+        conditions.append("channel_id = %s")
+        params.append(channel_id)
+    where = ' AND '.join(conditions)
+    total = None
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            if with_total:
+                await cur.execute(f"SELECT count(*) FROM channels WHERE {where};", params)
+                total = (await cur.fetchone())[0]
+            if after is not None:
+                where += " AND (ticker, signal_type, exchange, channel_id) > (%s, %s, %s, %s)"
+                params.extend(after)
+            await cur.execute(f'''
+                        SELECT ticker, channel_id, signal_type, exchange
+                        FROM channels
+                        WHERE {where}
+                        ORDER BY ticker, signal_type, exchange, channel_id
+                        LIMIT %s OFFSET %s;
+                        ''', params + [ALERTS_PAGE_SIZE, offset])
+            rows = await cur.fetchall()
+    return rows, total
+
+def alerts_embed(rows, page, total_pages):
+    embed = Embed(
+        title=f"List of Active Alerts: Page {page} of {total_pages}"
+    )
+    for ticker, channel_id, signal_type, exchange in rows:
+        channel = bot.get_channel(channel_id)
+        if ticker == ANY:
+            ticker = "any"
+        on_exchange = "" if exchange == ANY else f" on {exchange}"
+        if channel:
+            if signal_type == 'NONE':
+                embed.add_field(name="⚪ Coin: " + ticker + on_exchange, value=f"Sent in #{channel.name}", inline=False)
+            elif signal_type == ANY:
+                embed.add_field(name="🔵 All alerts and signals, Coin: " + ticker + on_exchange, value=f"Sent in #{channel.name}", inline=False)
+            else:
+                embed.add_field(name="⭐ Advanced Signal: " + signal_type + ", Coin: " + ticker + on_exchange, value=f"Sent in #{channel.name}", inline=False)
+        else:
+            embed.add_field(name=ticker, value=f"Possibly deleted channel with channel ID: {channel_id}")
+    return embed
+
+# Previous/Next buttons for !alerts. Rendered pages are kept for the life of the view, so paging
+# back and forth does not query the database or resolve channels again
+class AlertsView(discord.ui.View):
+    def __init__(self, author_id, server_id, ticker, channel_id, page, total_pages):
+        super().__init__(timeout=120)
+        self.author_id = author_id
+        self.server_id = server_id
+        self.ticker = ticker
+        self.channel_id = channel_id
+        self.page = page
+        self.total_pages = total_pages
+        self.pages = {}
+        self.message = None
+
+    def show(self, page, rows):
+        self.page = page
+        if page not in self.pages:
+            self.pages[page] = (rows, alerts_embed(rows, page, self.total_pages))
+        self.previous.disabled = page <= 1
+        self.next.disabled = page >= self.total_pages
+        return self.pages[page][1]
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.author_id
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction, button):
+        page = self.page - 1
+        rows = self.pages[page][0] if page in self.pages else (await fetch_alerts(self.server_id, self.ticker, self.channel_id, offset=(page - 1) * ALERTS_PAGE_SIZE))[0]
+        await interaction.response.edit_message(embed=self.show(page, rows), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction, button):
+        page = self.page + 1
+        if page in self.pages:
+            rows = self.pages[page][0]
+        else:
+            last = self.pages[self.page][0][-1]
+            rows, _ = await fetch_alerts(self.server_id, self.ticker, self.channel_id, after=(last[0], last[2], last[3], last[1]))
+        await interaction.response.edit_message(embed=self.show(page, rows), view=self)
+
 @bot.command()
-async def alerts(ctx, page: int = 1):
-    try:
-        async with pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute('''
-                            SELECT ticker, channel_id, signal_type
-                            FROM channels
-                            WHERE server_id = %s;
-                ''', (ctx.guild.id,))
-                channels = await cur.fetchall()
-
-            if not channels:
-                await ctx.send("No active alerts in this server. Use command !set channel [ticker] [signal (optional)] to set an active ticker alert to the channel.")
+async def alerts(ctx, *args):
+    # !alerts [page] [ticker prefix] [#channel], in any order
+    page = 1
+    ticker = None
+    channel_id = None
+    for arg in args:
+        if arg.isdigit():
+            page = int(arg)
+        elif arg.startswith('<#'):
+            try:
+                channel_id = (await commands.TextChannelConverter().convert(ctx, arg)).id
+            except commands.BadArgument:
+                await ctx.send(f"❌ Channel {arg} not found.")
                 return
+        else:
+            ticker = arg.upper()
+    if page < 1:
+        page = 1
+
+    try:
+        rows, total = await fetch_alerts(ctx.guild.id, ticker, channel_id, offset=(page - 1) * ALERTS_PAGE_SIZE, with_total=True)
     except Exception as e:
         logger.error(f"DB error in alerts: {e}")
         return
 
-    MAX_FIELDS = 25
-    total_pages = math.ceil(len(channels) / MAX_FIELDS)
+    if not total:
+        if ticker is None and channel_id is None:
+            await ctx.send("No active alerts in this server. Use command !set channel [ticker] [signal (optional)] to set an active ticker alert to the channel.")
+        else:
+            await ctx.send("No active alerts match that filter.")
+        return
 
-    if page < 1: 
-        page = 1
-    elif page > total_pages:
+    total_pages = math.ceil(total / ALERTS_PAGE_SIZE)
+    if page > total_pages:
         await ctx.send(f"❌ Page {page} does not exist. There are only {total_pages} pages.")
-        return 
-    
-    # The 25 alerts to be sent in this page (from start to end)
-    start = (page - 1) * MAX_FIELDS
-    end = start + MAX_FIELDS
-    alert_page = channels[start:end]
+        return
 
-    embed = Embed(
-        title=f"List of Active Alerts: Page {page} of {total_pages}"
-    )
+    view = AlertsView(ctx.author.id, ctx.guild.id, ticker, channel_id, page, total_pages)
+    embed = view.show(page, rows)
+    if total_pages == 1:
+        await ctx.send(embed=embed)
+        return
+    view.message = await ctx.send(embed=embed, view=view)
+
+STATUS_ICONS = {'delivered': '🟢', 'send_failed': '🔴', 'bad_secret': '🔒', 'disabled': '⏸️', 'no_channel': '⚪', 'channel_not_found': '⚪'}
+
+def history_embed(rows, ticker, signal_type, page):
+    title = "Alert History"
+    if ticker:
+        title += f": {ticker}" + (f" {signal_type}" if signal_type else "")
+    embed = Embed(title=f"{title} (page {page})", color=0x00b05e)
+    for _, created_at, row_ticker, row_signal, status, channel_id, text, open_, close, high, low, interval in rows:
+        name = f"{STATUS_ICONS.get(status, '⚪')} {row_ticker}"
+        if row_signal != 'NONE':
+            name += f" {row_signal}"
+        if interval:
+            name += f" ({interval})"
+        value = f"{(text or '')[:200]}\n{status} <t:{int(created_at.timestamp())}:f>"
+        if channel_id:
+            value += f" in <#{channel_id}>"
+        prices = [f"{label} {price:g}" for label, price in (('O', open_), ('H', high), ('L', low), ('C', close)) if price is not None]
+        if prices:
+            value += "\n" + " ".join(prices)
+        embed.add_field(name=name, value=value, inline=False)
+    return embed
+
+# Newer/Older buttons over keyset pages, the cursors of pages already seen are kept for going back
+class HistoryView(discord.ui.View):
+    def __init__(self, author_id, server_id, ticker, signal_type):
+        super().__init__(timeout=120)
+        self.author_id = author_id
+        self.server_id = server_id
+        self.ticker = ticker
+        self.signal_type = signal_type
+        self.cursors = [None]
+        self.rows = []
+        self.has_older = False
+
+    async def load(self):
+        self.rows, self.has_older = await history.page(self.server_id, self.ticker, self.signal_type, before=self.cursors[-1])
+        self.newer.disabled = len(self.cursors) == 1
+        self.older.disabled = not self.has_older
+        return history_embed(self.rows, self.ticker, self.signal_type, len(self.cursors))
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.author_id
+
+    @discord.ui.button(label="Newer", style=discord.ButtonStyle.secondary)
+    async def newer(self, interaction, button):
+        self.cursors.pop()
+        await interaction.response.edit_message(embed=await self.load(), view=self)
+
+    @discord.ui.button(label="Older", style=discord.ButtonStyle.secondary)
+    async def older(self, interaction, button):
+        last = self.rows[-1]
+        self.cursors.append((last[1], last[0]))
+        await interaction.response.edit_message(embed=await self.load(), view=self)
+
+@bot.command(name="history")
+async def history_command(ctx, ticker=None, signal=None):
+    ticker = ticker.upper() if ticker else None
+    signal_type = signal.upper() if signal else None
+    view = HistoryView(ctx.author.id, ctx.guild.id, ticker, signal_type)
+    try:
+        embed = await view.load()
+    except Exception as e:
+        logger.error(f"DB error in history: {e}")
+        return
+    if not view.rows:
+        await ctx.send("No alert history found. Usage: !history [ticker] [signal (optional)]")
+        return
+    await ctx.send(embed=embed, view=view)
+
+# Server settings, cached; the destination channels come from the in-memory subscription index
+SERVER_QUERY = '''
+        SELECT alerts_on, secret, digest_window, template
+        FROM servers
+        WHERE server_id = %s
+'''
+
+async def lookup_server(server_id):
+    # A settings change committed while the row is read invalidates it, don't cache the old row
+    generation = server_cache.generation(server_id)
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SERVER_QUERY, (server_id,), prepare=True)
+            res = await cur.fetchone()
+    server = None if res is None else tuple(res)
+    server_cache.set(server_id, server, generation)
+    return server
+
+# Returns the send futures, one per destination channel, or None if nothing was sent
+async def process_alert(alert):
+    trace("Alert received in queue: %s", alert)
+    saved_secret = None
+    server_id = alert.server_id
+    ticker = alert.ticker
+    # Check if advanced signal
+    signal_type = 'NONE'
+    if alert.signal_type:
+        signal_type = alert.signal_type.upper()
+    # Check for secret
+    secret = alert.secret
+    if secret is not None:
+        secret = secret.strip()
+
+    # Server settings, cached to skip the DB on repeat alerts
+    route_key = (server_id, ticker, signal_type)
+    server = server_cache.get(server_id)
+    if server is MISSING:
+        started = time.perf_counter()
+        server = await lookup_server(server_id)
+        stage_seconds.observe(time.perf_counter() - started, 'db')
+        trace("Looked up server_id=%s: %s", server_id, server)
+    if server is None:
+        trace("Server is not in server list.")
+        alerts_total.inc('unknown_server')
+        return
+    alerts_on = server[0]
+    # Check if secret set in server
+    if server[1] is not None:
+        saved_secret = server[1]
+
+    if saved_secret is not None:    
+        if not secret or not hmac.compare_digest(secret, saved_secret):
+            trace("Incorrect secret.")
+            record_outcome(alert, 'bad_secret')
+            return
+        trace("✅ Secret passed!")
+
+    if not alerts_on:
+        trace("Alerts are disabled for server %s.", server_id)
+        record_outcome(alert, 'disabled')
+        return
 
-    for ticker, channel_id, signal_type in alert_page:
+    channel_ids = subscriptions.match(server_id, ticker, signal_type, alert.exchange)
+    trace("Matched channels for ticker=%s, signal_type=%s: %s", ticker, signal_type, channel_ids)
+    if not channel_ids:
+        logger.error(f"No channel set for server {server_id} and ticker {ticker}.")
+        record_outcome(alert, 'no_channel')
+        return
+    channels = []
+    for channel_id in sorted(channel_ids):
         channel = bot.get_channel(channel_id)
         if channel:
-            if signal_type == 'NONE':  
-                embed.add_field(name="⚪ Coin: " + ticker, value=f"Sent in #{channel.name}", inline=False)
-            else: 
-                embed.add_field(name="⭐ Advanced Signal: " + signal_type + ", Coin: " + ticker, value=f"Sent in #{channel.name}", inline=False)
+            channels.append(channel)
         else:
-            embed.add_field(name=ticker, value=f"Possibly deleted channel with channel ID: {channel_id}")
+            logger.error(f"Channel ID {channel_id} not found.")
+            record_outcome(alert, 'channel_not_found', channel_id)
+    if not channels:
+        return
 
-    await ctx.send(embed=embed)
-        
-
-async def alert_request():
-    logger.info("✅ alert_request loop started.")
-    while True:
-        item_added = False
-        try: 
-            alert = await queue.get()
-            item_added = True
-            logger.info(f"Alert received in queue: {alert}")
-            async with pool.connection() as conn:
-                saved_secret = None
-                if isinstance(alert, dict):
-                    # Required json keys 
-                    if 'server_id' in alert and 'ticker' in alert and 'alert' in alert:
-                        server_id = alert['server_id']
-                        ticker = alert['ticker']
-                        # Check if advanced signal
-                        signal_type = 'NONE'
-                        if 'signal_type' in alert and alert['signal_type']:
-                            signal_type = alert['signal_type'].upper()
-                        logger.info(signal_type)
-                        # Check for secret
-                        secret = alert.get('secret')
-                        if secret is not None:
-                            secret = secret.strip()
-                            
-
-                        async with conn.cursor() as cur:
-                            # Check if alerts are enabled for this server
-                            await cur.execute('SELECT alerts_on, secret FROM servers WHERE server_id = %s', (server_id,))
-                            res = await cur.fetchone()
-                            if res is None:
-                                logger.info("Server is not in server list.")
-                                continue
-                            else:
-                                alerts_on = res[0]
-                            # Check if secret set in server
-                            if res[1] is not None:
-                                saved_secret = res[1]
-
-                            if saved_secret is not None:    
-                                if not secret or not hmac.compare_digest(secret, saved_secret):
-                                    logger.info("Incorrect secret.")
-                                    continue
-                                logger.info("✅ Secret passed!")
-
-                        if alerts_on:
-                            async with conn.cursor() as cur:
-                                # Get channel_id for this server and ticker
-                                await cur.execute('SELECT channel_id FROM channels WHERE server_id = %s AND ticker = %s AND signal_type = %s', (server_id, ticker, signal_type))
-                                res = await cur.fetchone()
-                                logger.info(f"Looking for channel with server_id={server_id}, ticker={ticker}, signal_type={signal_type}")
-                                logger.info(f"Query result: {res}")
-
-                            if res:
-                                channel_id = res[0]
-                                channel = bot.get_channel(channel_id)
-
-                                if channel:
-                                    embed = Embed(
-                                        title=f"🚨 Alert: {ticker}",
-                                        description=alert['alert'],
-                                        color=0x00b05e
-                                    )
-                                    # Optional fields
-                                    for field in ['signal_type', 'exchange', 'time', 'interval', 'high', 'low', 'open', 'close']:
-                                        if field in alert:
-                                            value = alert[field]
-                                            name = field.capitalize()
-                                            if field == 'time':
-                                                try:
-                                                    value = datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M UTC')
-                                                except Exception:
-                                                    pass
-                                            if field == 'signal_type':
-                                                if (alert.get('signal_type') or 'NONE').upper() == 'NONE':
-                                                    continue
-                                                else:
-                                                    name = 'Advanced Signal'
-                                                    value = alert[field].upper()
-                                            embed.add_field(name=name, value=value, inline=True)
-
-                                    embed.set_footer(text="Source: TradingView webhooks")
-
-                                    await channel.send(embed=embed)
-                                else:
-                                    logger.error(f"Channel ID {channel_id} not found.")
-                            else:
-                                logger.error(f"No channel set for server {server_id} and ticker {ticker}.")
-                        else:
-                            logger.info(f"Alerts are disabled for server {server_id}.")
-                    else:
-                        logger.error("ERROR: Missing required keys (server_id, ticker, alert) in alert JSON")
-                else:
-                    # Handle non-dict alerts (if needed)
-                    logger.error(f"Received non-dict alert: {alert}")
-        except Exception as e:
-            logger.error(f"ERROR while processing alert: {e}")
-            logger.error(traceback.format_exc())
+    # Context from recent alerts for this ticker and interval, kept in memory
+    state = market.record(alert)
+    # Repeats within the server's digest window are folded into one later message
+    if server[2] and coalescer.absorb(route_key, alert, channels, server[2]):
+        for channel in channels:
+            record_outcome(alert, 'coalesced', channel.id)
+        return
+
+    started = time.perf_counter()
+    try:
+        template = templates.get(server[3])
+    except templates.TemplateError as e:
+        logger.error(f"Template for server {server_id} no longer compiles, using the default: {e}")
+        template = templates.get()
+    embed = template.render(alert, signal_type, state)
+    stage_seconds.observe(time.perf_counter() - started, 'embed')
+
+    # Submitting only queues the embed; the scheduler drains each channel in its own task,
+    # so the sends to the destinations run concurrently
+    sends = []
+    for channel in channels:
+        sent = await sender.submit(channel, embed, alert.alert_id)
+        sent.add_done_callback(on_sent(alert, channel.id))
+        sends.append(sent)
+    return sends
+
+def digest_embed(window):
+    title = f"🚨 Alert digest: {window.ticker}"
+    if window.signal_type != 'NONE':
+        title += f" ({window.signal_type})"
+    embed = Embed(
+        title=title,
+        description=f"{window.count} more alerts in the last {window.seconds}s",
+        color=0x00b05e
+    )
+    if window.last_alert:
+        embed.add_field(name="Latest", value=window.last_alert[:1024], inline=False)
+    if window.low is not None:
+        embed.add_field(name="Range", value=f"{window.low:g} - {window.high:g}", inline=True)
+    if window.first_close is not None:
+        embed.add_field(name="Close", value=f"{window.first_close:g} → {window.last_close:g}", inline=True)
+    embed.set_footer(text="Source: TradingView webhooks")
+    return embed
+
+async def send_digest(window):
+    embed = digest_embed(window)
+    for channel in window.channels:
+        await sender.submit(channel, embed)
+
+coalescer = Coalescer(send_digest)
+
+def record_outcome(alert, outcome, channel_id=None):
+    alerts_total.inc(outcome)
+    history.record(alert, outcome, channel_id)
+
+def on_sent(alert, channel_id):
+    def callback(future):
+        if future.cancelled() or future.exception() is not None:
+            record_outcome(alert, 'send_failed', channel_id)
+            return
+        record_outcome(alert, 'delivered', channel_id)
+    return callback
+
+# Once every destination has settled. If all of them failed the outbox row is left for a retry,
+# otherwise it is acknowledged so the channels that did get the alert do not get it twice
+def on_settled(alert):
+    def callback(done):
+        if all(isinstance(result, BaseException) for result in done.result()):
+            if alert.outbox_id is not None:
+                outbox.release(alert.outbox_id)
+            return
+        if alert.received is not None:
+            stage_seconds.observe(time.time() - alert.received, 'end_to_end')
+        if alert.outbox_id is not None:
+            outbox.ack(alert.outbox_id)
+    return callback
+
+async def deliver_alert(alert):
+    await gateway.wait(shard_for(alert.server_id))
+    tokens = begin_alert(alert)
+    try:
+        if alert.received is not None:
+            stage_seconds.observe(time.time() - alert.received, 'queue')
+        sends = await process_alert(alert)
+        if sends:
+            asyncio.gather(*sends, return_exceptions=True).add_done_callback(on_settled(alert))
+        # Only acknowledged once handled, failed alerts are retried after the outbox lease expires
+        elif alert.outbox_id is not None:
+            outbox.ack(alert.outbox_id)
+    except Exception:
+        if alert.outbox_id is not None:
+            outbox.release(alert.outbox_id)
+        raise
+    finally:
+        # The worker goes on to other alerts in this context
+        end_alert(tokens)
+
+# One dispatcher per local shard. With several, a router splits the shared queue by shard first
+if len(SHARD_IDS) == 1:
+    router = None
+    dispatchers = {SHARD_IDS[0]: Dispatcher(queue, deliver_alert)}
+else:
+    router = ShardRouter(queue)
+    dispatchers = {shard_id: Dispatcher(shard_queue, deliver_alert, math.ceil(ALERT_WORKERS / len(SHARD_IDS)))
+                   for shard_id, shard_queue in router.queues.items()}
+
+def dispatcher_runner(dispatcher):
+    async def run_dispatcher():
+        try:
+            await dispatcher.run()
         finally:
-            if item_added:
-                queue.task_done()
+            await dispatcher.stop()
+    return run_dispatcher
+
+# Alerts taken from the ingest queue and not yet handled
+def in_flight():
+    queued = sum(sum(d.stats()["queued"]) for d in dispatchers.values())
+    if router is not None:
+        queued += sum(q.qsize() for q in router.queues.values())
+    return queued
+
+def shard_stats():
+    stats = {}
+    for shard_id, dispatcher in dispatchers.items():
+        latency = bot.get_shard(shard_id).latency if SHARDED and bot.get_shard(shard_id) else bot.latency
+        stats[str(shard_id)] = {
+            "ready": gateway.ready[shard_id].is_set(),
+            "disconnects": gateway.disconnects[shard_id],
+            "latency_ms": round(latency * 1000, 1) if math.isfinite(latency) else None,
+            # In the shard's queue, then per worker in "queued"
+            "waiting": router.queues[shard_id].qsize() if router is not None else queue.qsize(),
+            **dispatcher.stats(),
+        }
+    return stats
+
+# Alert consumers, started by main.lifespan and restarted with backoff if they crash
+supervisor = Supervisor()
+if router is None:
+    supervisor.add("dispatcher", dispatcher_runner(dispatchers[SHARD_IDS[0]]))
+else:
+    supervisor.add("shard_router", router.run)
+    for shard_id, dispatcher in dispatchers.items():
+        supervisor.add(f"dispatcher_shard_{shard_id}", dispatcher_runner(dispatcher))
+if outbox.OUTBOX_ENABLED:
+    supervisor.add("outbox_claim", lambda: outbox.claim_loop(queue, gateway))
+    supervisor.add("outbox_listen", outbox.listen_loop)
+    supervisor.add("outbox_prune", outbox.prune_loop)
+    supervisor.add("outbox_dead_letter", outbox.dead_letter_loop)
+if history.HISTORY_ENABLED:
+    supervisor.add("history_maintenance", history.maintain_loop)
+if market.MARKET_STATE_ENABLED:
+    supervisor.add("market_snapshot", market.snapshot_loop)
+supervisor.add("subscription_refresh", subscriptions.refresh_loop)
+supervisor.add("rate_limit_refresh", limiter.refresh_loop)
+supervisor.add("digest_wheel", coalescer.run)
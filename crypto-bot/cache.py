@@ -0,0 +1,80 @@
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Sentinel for "nothing cached", so None can be cached as a real (negative) result
+MISSING = object()
+
+class TTLCache:
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        # Bumped by invalidations, so a value read before one is not cached after it
+        self._generations = {}
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # Take before reading the value to cache, and pass to set()
+    def generation(self, key):
+        return self._generations.get(key, 0)
+
+    # With a generation, the value is dropped if the key was invalidated since it was taken
+    def set(self, key, value, generation=None):
+        if generation is not None and generation != self.generation(key):
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        # Evict least recently used entries past the size bound
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._data.pop(key, None)
+
+    # Drops the entry without recording an invalidation, for keys never set() with a generation
+    def discard(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", 10000))
+CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", 300))
+
+# server_id -> (alerts_on, secret, digest_window, template), or None if the server is not registered.
+# Destination channels are matched by the subscription index in routing.py
+server_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+def invalidate_server(server_id):
+    server_cache.invalidate(server_id)
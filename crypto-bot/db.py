@@ -1,6 +1,8 @@
 import os
+import time
 import psycopg_pool
 from dotenv import load_dotenv
+from metrics import Counter, Histogram
 
 load_dotenv()
 
@@ -12,4 +14,52 @@ conninfo = (
     f"password={os.getenv('DB_PASSWORD', 'postgres')}"
 )
 
-pool = psycopg_pool.AsyncConnectionPool(conninfo=conninfo, open=False)
\ No newline at end of file
+# Size the pool for ALERT_WORKERS concurrent route lookups plus the batch writers, outbox
+# claims and bot commands; requests_waiting in /stats shows when max_size is too small
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 4))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 600))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 3600))
+DB_POOL_OPEN_TIMEOUT = float(os.getenv("DB_POOL_OPEN_TIMEOUT", 30))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 5000))
+
+checkout_seconds = Histogram("db_checkout_seconds", "Time waiting for a pooled connection")
+checkout_errors = Counter("db_checkout_errors_total", "Failed connection checkouts", ("error",))
+
+class InstrumentedPool(psycopg_pool.AsyncConnectionPool):
+    async def getconn(self, timeout=None):
+        started = time.perf_counter()
+        try:
+            conn = await super().getconn(timeout)
+        except Exception as e:
+            checkout_errors.inc(type(e).__name__)
+            raise
+        checkout_seconds.observe(time.perf_counter() - started)
+        return conn
+
+pool = InstrumentedPool(
+    conninfo=conninfo,
+    open=False,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=max(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+    timeout=DB_POOL_TIMEOUT,
+    max_idle=DB_POOL_MAX_IDLE,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    # A slow query is cancelled server-side instead of holding its connection indefinitely
+    kwargs={"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"} if DB_STATEMENT_TIMEOUT_MS else None,
+)
+
+# The pool is opened without waiting at startup; this returns once min_size connections are up,
+# so the consumers started after it do not pay for the handshakes
+async def wait_pool():
+    started = time.perf_counter()
+    await pool.wait(timeout=DB_POOL_OPEN_TIMEOUT)
+    return time.perf_counter() - started
+
+def pool_stats():
+    stats = pool.get_stats()
+    stats["checkout_p50_ms"] = round(checkout_seconds.quantile(0.5) * 1000, 2)
+    stats["checkout_p99_ms"] = round(checkout_seconds.quantile(0.99) * 1000, 2)
+    stats["statement_timeout_ms"] = DB_STATEMENT_TIMEOUT_MS
+    return stats
@@ -0,0 +1,42 @@
+import hashlib
+import os
+from dotenv import load_dotenv
+from cache import TTLCache, MISSING
+
+load_dotenv()
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() in ("1", "true", "yes")
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", 300))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", 100000))
+
+# fingerprint -> True for alerts accepted within the last DEDUP_WINDOW seconds
+seen = TTLCache(DEDUP_MAX_ENTRIES, DEDUP_WINDOW)
+
+def fingerprint(alert, idempotency_key=None):
+    if idempotency_key:
+        return (alert.server_id, idempotency_key)
+    signal_type = (alert.signal_type or 'NONE').upper()
+    key = repr((alert.server_id, alert.ticker, signal_type, alert.time, alert.alert))
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+def is_duplicate(fp):
+    return seen.get(fp) is not MISSING
+
+# Only called once an alert is accepted, so a shed alert can still be retried
+def remember(fp):
+    seen.set(fp, True)
+
+def forget(fp):
+    seen.discard(fp)
+
+def stats():
+    stats = seen.stats()
+    return {
+        "enabled": DEDUP_ENABLED,
+        "window": DEDUP_WINDOW,
+        "entries": stats["size"],
+        "maxsize": stats["maxsize"],
+        "checked": stats["hits"] + stats["misses"],
+        "duplicates": stats["hits"],
+        "duplicate_rate": stats["hit_rate"],
+    }
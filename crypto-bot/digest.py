@@ -0,0 +1,106 @@
+import asyncio
+import math
+import os
+from dotenv import load_dotenv
+from shared import logger
+
+load_dotenv()
+
+# Longest debounce window a server can set, and the resolution windows are flushed at
+DIGEST_MAX_WINDOW = int(os.getenv("DIGEST_MAX_WINDOW", 3600))
+DIGEST_TICK = float(os.getenv("DIGEST_TICK", 1))
+
+# Hashed timer wheel: one bucket per tick, enough buckets for the longest window, so scheduling is
+# a set insert and each tick only looks at the windows due in it, however many are open
+class TimerWheel:
+    def __init__(self, horizon=DIGEST_MAX_WINDOW, tick=DIGEST_TICK):
+        self.tick = tick
+        self.buckets = [set() for _ in range(int(math.ceil(horizon / tick)) + 2)]
+        self.position = 0
+
+    def schedule(self, key, delay):
+        ticks = min(max(1, int(math.ceil(delay / self.tick))), len(self.buckets) - 1)
+        self.buckets[(self.position + ticks) % len(self.buckets)].add(key)
+
+    # Move one tick forward and return the keys that came due
+    def advance(self):
+        self.position = (self.position + 1) % len(self.buckets)
+        due = self.buckets[self.position]
+        self.buckets[self.position] = set()
+        return due
+
+# Alerts folded into one digest for a (server, ticker, signal) during its window
+class Window:
+    __slots__ = ('channels', 'ticker', 'signal_type', 'seconds', 'count', 'low', 'high', 'first_close', 'last_close', 'last_alert')
+
+    def __init__(self, channels, ticker, signal_type, seconds):
+        self.channels = channels
+        self.ticker = ticker
+        self.signal_type = signal_type
+        self.seconds = seconds
+        self.count = 0
+        self.low = None
+        self.high = None
+        self.first_close = None
+        self.last_close = None
+        self.last_alert = None
+
+    def fold(self, alert):
+        self.count += 1
+        self.last_alert = alert.alert
+        for price in (alert.low, alert.high, alert.close):
+            if price is not None:
+                self.low = price if self.low is None else min(self.low, price)
+                self.high = price if self.high is None else max(self.high, price)
+        if alert.close is not None:
+            if self.first_close is None:
+                self.first_close = alert.close
+            self.last_close = alert.close
+
+class Coalescer:
+    # `await send(window)` is called for every window that folded at least one alert when it closes
+    def __init__(self, send, wheel=None):
+        self.send = send
+        self.wheel = wheel or TimerWheel()
+        self.windows = {}
+        self.coalesced = 0
+        self.digests = 0
+
+    # False for the first alert of a key, which opens a window and should be sent as usual.
+    # True when the alert was folded into the open window's digest instead
+    def absorb(self, key, alert, channels, seconds):
+        window = self.windows.get(key)
+        if window is None:
+            self.windows[key] = Window(channels, alert.ticker, key[2], min(seconds, DIGEST_MAX_WINDOW))
+            self.wheel.schedule(key, self.windows[key].seconds)
+            return False
+        window.channels = channels
+        window.fold(alert)
+        self.coalesced += 1
+        return True
+
+    async def flush_due(self):
+        for key in self.wheel.advance():
+            window = self.windows.pop(key, None)
+            if window is None or not window.count:
+                continue
+            self.digests += 1
+            try:
+                await self.send(window)
+            except Exception as e:
+                logger.error(f"Digest send error for {key}: {e}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.wheel.tick
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            await self.flush_due()
+
+    def stats(self):
+        return {
+            "open_windows": len(self.windows),
+            "coalesced": self.coalesced,
+            "digests": self.digests,
+        }
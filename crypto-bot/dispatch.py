@@ -0,0 +1,72 @@
+import asyncio
+import os
+import traceback
+from dotenv import load_dotenv
+from shared import logger
+
+load_dotenv()
+
+ALERT_WORKERS = int(os.getenv("ALERT_WORKERS", 4))
+# Kept small so a backlog builds up in the bounded, observable shared queue instead
+WORKER_QUEUE_SIZE = int(os.getenv("ALERT_WORKER_QUEUE_SIZE", 16))
+
+def route_key(alert):
+    # Every channel an alert goes to belongs to its server, and different tickers (or wildcard
+    # subscriptions) can share a channel, so hashing on the server keeps per-channel delivery in order
+    return alert.server_id
+
+class Dispatcher:
+    def __init__(self, source, handler, workers=ALERT_WORKERS, key=route_key):
+        self.source = source
+        self.handler = handler
+        self.key = key
+        self.queues = [asyncio.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(max(1, workers))]
+        self.processed = [0] * len(self.queues)
+        self.tasks = []
+
+    def start(self):
+        if self.tasks:
+            return self.tasks
+        self.tasks = [asyncio.create_task(self._worker(i)) for i in range(len(self.queues))]
+        self.tasks.append(asyncio.create_task(self._route()))
+        logger.info(f"✅ Dispatcher started with {len(self.queues)} workers.")
+        return self.tasks
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def run(self):
+        self.start()
+        await asyncio.gather(*self.tasks)
+
+    def worker_for(self, alert):
+        return hash(self.key(alert)) % len(self.queues)
+
+    async def _route(self):
+        while True:
+            alert = await self.source.get()
+            await self.queues[self.worker_for(alert)].put(alert)
+
+    async def _worker(self, index):
+        queue = self.queues[index]
+        while True:
+            alert = await queue.get()
+            try:
+                await self.handler(alert)
+            except Exception as e:
+                logger.error(f"ERROR while processing alert: {e}")
+                logger.error(traceback.format_exc())
+            finally:
+                self.processed[index] += 1
+                queue.task_done()
+                self.source.task_done()
+
+    def stats(self):
+        return {
+            "workers": len(self.queues),
+            "queued": [q.qsize() for q in self.queues],
+            "processed": list(self.processed),
+        }
@@ -0,0 +1,192 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from db import pool
+from shared import logger
+from batch_writer import BatchWriter
+
+load_dotenv()
+
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() in ("1", "true", "yes")
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 500))
+HISTORY_FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", 1000))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", 30))
+HISTORY_PARTITIONS_AHEAD = int(os.getenv("HISTORY_PARTITIONS_AHEAD", 3))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 10))
+
+# One partition per UTC day, so retention is a DROP TABLE instead of a bulk DELETE. Listing is
+# newest first per server, optionally per ticker; the signal filter is applied on top of that.
+# Webhook text goes in unbounded TEXT columns: one over-long value would fail the whole COPY batch.
+# Tables created with VARCHARs are converted once; the ALTER locks every partition, so not on each start
+HISTORY_DDL = '''--begin-sql
+        CREATE TABLE IF NOT EXISTS alert_history (
+        id BIGSERIAL,
+        created_at TIMESTAMPTZ NOT NULL,
+        server_id BIGINT NOT NULL,
+        ticker TEXT NOT NULL,
+        signal_type TEXT NOT NULL DEFAULT 'NONE',
+        status VARCHAR(20) NOT NULL,
+        channel_id BIGINT,
+        alert TEXT,
+        alert_time TEXT,
+        open DOUBLE PRECISION,
+        close DOUBLE PRECISION,
+        high DOUBLE PRECISION,
+        low DOUBLE PRECISION,
+        interval TEXT,
+        exchange TEXT,
+        PRIMARY KEY (created_at, id)
+        ) PARTITION BY RANGE (created_at);
+        CREATE INDEX IF NOT EXISTS alert_history_server_idx
+        ON alert_history (server_id, created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS alert_history_ticker_idx
+        ON alert_history (server_id, ticker, created_at DESC, id DESC);
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                AND table_name = 'alert_history'
+                AND column_name IN ('ticker', 'signal_type', 'interval', 'exchange')
+                AND data_type = 'character varying'
+            ) THEN
+                ALTER TABLE alert_history
+                ALTER COLUMN ticker TYPE TEXT,
+                ALTER COLUMN signal_type TYPE TEXT,
+                ALTER COLUMN interval TYPE TEXT,
+                ALTER COLUMN exchange TYPE TEXT;
+            END IF;
+        END
+        $$;
+'''
+
+COLUMNS = ('created_at', 'server_id', 'ticker', 'signal_type', 'status', 'channel_id', 'alert',
+           'alert_time', 'open', 'close', 'high', 'low', 'interval', 'exchange')
+
+PARTITION_PREFIX = "alert_history_p"
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+async def _insert(rows):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            async with cur.copy(f"COPY alert_history ({', '.join(COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    await copy.write_row(row)
+        await conn.commit()
+
+writer = BatchWriter(_insert, HISTORY_BATCH_SIZE, HISTORY_FLUSH_MS / 1000, name="alert_history")
+
+# Buffer an alert's outcome for the history table, never waits on the database
+def record(alert, status, channel_id=None):
+    if not HISTORY_ENABLED:
+        return
+    received = alert.received if alert.received is not None else datetime.now(timezone.utc).timestamp()
+    writer.add_nowait((
+        datetime.fromtimestamp(received, timezone.utc),
+        alert.server_id,
+        alert.ticker.upper(),
+        (alert.signal_type or 'NONE').upper(),
+        status,
+        channel_id,
+        alert.alert,
+        alert.time,
+        alert.open,
+        alert.close,
+        alert.high,
+        alert.low,
+        alert.interval,
+        alert.exchange,
+    ))
+
+async def create_partitions(cur, today):
+    for offset in range(HISTORY_PARTITIONS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        await cur.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {partition_name(day)}
+                    PARTITION OF alert_history
+                    FOR VALUES FROM ('{day.isoformat()} 00:00+00') TO ('{(day + timedelta(days=1)).isoformat()} 00:00+00');
+                    ''')
+
+# Drops whole days that fell out of the retention window
+async def drop_partitions(cur, today):
+    await cur.execute('''
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'alert_history'::regclass;
+                ''')
+    cutoff = today - timedelta(days=HISTORY_RETENTION_DAYS)
+    dropped = []
+    for (name,) in await cur.fetchall():
+        try:
+            day = datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()
+        except ValueError:
+            continue
+        if day < cutoff:
+            await cur.execute(f"DROP TABLE IF EXISTS {name};")
+            dropped.append(name)
+    return dropped
+
+async def maintain():
+    today = datetime.now(timezone.utc).date()
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await create_partitions(cur, today)
+            dropped = await drop_partitions(cur, today)
+        await conn.commit()
+    if dropped:
+        logger.info(f"History: dropped {len(dropped)} expired partitions.")
+
+async def init_schema():
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(HISTORY_DDL)
+        await conn.commit()
+    await maintain()
+
+async def maintain_loop():
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            await maintain()
+        except Exception as e:
+            logger.error(f"History maintenance error: {e}")
+
+# Keyset pagination, newest first: `before` is the (created_at, id) of the last row already shown.
+# Returns up to `limit` rows and whether older rows remain
+async def page(server_id, ticker=None, signal_type=None, before=None, limit=HISTORY_PAGE_SIZE):
+    conditions = ["server_id = %s"]
+    params = [server_id]
+    if ticker is not None:
+        conditions.append("ticker = %s")
+        params.append(ticker)
+    if signal_type is not None:
+        conditions.append("signal_type = %s")
+        params.append(signal_type)
+    if before is not None:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(before)
+    params.append(limit + 1)
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f'''
+                        SELECT id, created_at, ticker, signal_type, status, channel_id, alert, open, close, high, low, interval
+                        FROM alert_history
+                        WHERE {' AND '.join(conditions)}
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s;
+                        ''', params)
+            rows = await cur.fetchall()
+    return rows[:limit], len(rows) > limit
+
+async def close():
+    await writer.close()
+
+def stats():
+    return {
+        "enabled": HISTORY_ENABLED,
+        "writer": writer.stats(),
+    }
@@ -0,0 +1,106 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json: one JSON object per line, text: the previous "time | level | message" lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_FILE = os.getenv("LOG_FILE", "discord.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Share of alerts whose per-alert detail lines are logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(message)s"
+
+# Correlation id of the alert being handled, and whether its detail lines are sampled
+alert_id = contextvars.ContextVar("alert_id", default=None)
+sampled = contextvars.ContextVar("sampled", default=False)
+
+def new_alert_id():
+    return os.urandom(8).hex()
+
+# Tag the current context with an alert and roll the sampling decision for its detail lines.
+# Returns the tokens to pass to end_alert once the alert is handled
+def begin_alert(alert):
+    return (alert_id.set(alert.alert_id), sampled.set(LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE))
+
+def end_alert(tokens):
+    alert_id.reset(tokens[0])
+    sampled.reset(tokens[1])
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            # QueueHandler.prepare has already merged any traceback into the message
+            "message": record.getMessage(),
+        }
+        if getattr(record, "alert_id", None) is not None:
+            entry["alert_id"] = record.alert_id
+        return orjson.dumps(entry, default=str).decode()
+
+# Runs in the caller's context before the record is queued, so the alert id is still visible
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.alert_id = alert_id.get()
+        return True
+
+# Never blocks the caller: records are dropped and counted when the listener falls behind
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    # Like QueueHandler.prepare, minus the copy of the record: nothing else handles it after us
+    def prepare(self, record):
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BlockingStopListener(logging.handlers.QueueListener):
+    # The stop sentinel must not be dropped when the queue is full
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+# Callers only format the message and enqueue the record, a QueueListener thread does the
+# JSON encoding and the stdout/file writes off the event loop
+def setup_logging():
+    outputs = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        outputs.append(logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    for output in outputs:
+        output.setFormatter(formatter)
+
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [handler]
+
+    listener = BlockingStopListener(handler.queue, *outputs, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler, listener
@@ -1,48 +1,120 @@
+import time
+# Startup stages are reported relative to this, see /health
+STARTED = time.perf_counter()
 import asyncio
-import discord
-from discord.ext import commands
-from discord import Embed
-import logging
 from dotenv import load_dotenv
 import os
-import json
-from datetime import datetime
-import sys
-from fastapi import FastAPI, Request, HTTPException, status
+import orjson
+import math
+from fastapi import FastAPI, Request, HTTPException, Header, status
+from typing import Optional
 from contextlib import asynccontextmanager
-from shared import logger, queue
-from db import pool
-from bot import bot
-from models import AlertPayload
+from shared import logger, queue, prefixes, prefix_stats, ROLE, log_handler
+from logs import alert_id
+from db import pool, wait_pool, pool_stats
+from models import AlertPayload, Alert, AlertValidationError
+from cache import server_cache
+from routing import subscriptions
+import outbox
+import history
+import market
+import metrics
+from metrics import Gauge, CallbackCounter, stage_seconds, webhook_alerts_total
+from fastapi.responses import PlainTextResponse
+import dedup
+from alert_queue import TenantQueueFull, QUEUE_RETRY_AFTER, QUEUE_MAX_SIZE
+from ratelimit import limiter, RateLimited
+
+# The ingest role never connects to the gateway, so it does not import discord.py or the bot
+if ROLE == "ingest":
+    delivery = None
+else:
+    import bot as delivery
 
 asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 
 load_dotenv()
 
-handler = logging.StreamHandler(sys.stdout)
-logger = logging.getLogger("discord")
-logger.setLevel(logging.INFO)
-logger.addHandler(handler)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+STARTUP_RETRY_SECONDS = float(os.getenv("STARTUP_RETRY_SECONDS", 5))
+
+# Seconds from import to each startup stage, and to the first accepted webhook
+startup_times = {}
+
+def mark(stage):
+    if stage not in startup_times:
+        startup_times[stage] = round(time.perf_counter() - STARTED, 3)
+
+# Database setup and the consumers, run in the background so webhooks are accepted while it
+# happens. Alerts wait in the queue (or the outbox writer) until delivery can start. Retried until
+# it succeeds; every step is idempotent
+async def startup():
+    while True:
+        try:
+            warmup = await wait_pool()
+            mark("pool")
+            logger.info(f"Database pool warmed up with {pool.get_stats()['pool_size']} connections in {warmup:.2f}s")
+            if ROLE == "ingest":
+                await outbox.init_schema()
+            else:
+                # Schema and consumers are set up once here; on_ready fires again on every gateway reconnect
+                await delivery.init_schema()
+                await market.load()
+            mark("schema")
+            try:
+                await limiter.load()
+            except Exception as e:
+                logger.warning(f"Could not load webhook rate limits, using the default for every server: {e}")
+            if ROLE == "ingest":
+                await limiter.refresh_loop()
+            else:
+                delivery.supervisor.start()
+                mark("consumers")
+            return
+        except Exception as e:
+            logger.error(f"Startup error, retrying in {STARTUP_RETRY_SECONDS}s: {e}")
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await pool.open()
-    token = os.getenv("DISCORD_TOKEN")
-    if not token:
-        raise RuntimeError("DISCORD_TOKEN not set in .env")
-    task = asyncio.create_task(bot.start(token))
+    task = None
+    if delivery is not None:
+        token = os.getenv("DISCORD_TOKEN")
+        if not token:
+            raise RuntimeError("DISCORD_TOKEN not set in .env")
+    # Connections are opened in the background, nothing below waits on Postgres or Discord
+    await pool.open(wait=False)
+    startup_task = asyncio.create_task(startup())
+    if delivery is not None:
+        # The gateway handshake overlaps the database setup; alerts are held until on_ready
+        task = asyncio.create_task(delivery.bot.start(token))
+    mark("accepting")
     yield
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        logger.info("Bot task cancelled cleanly.")
+    startup_task.cancel()
+    if task is not None:
+        task.cancel()
+        await delivery.supervisor.stop()
+        # Not before the snapshot was loaded, or an early shutdown would overwrite it with nothing
+        if "schema" in startup_times:
+            try:
+                await market.save()
+            except Exception as e:
+                logger.warning(f"Error saving market state: {e}")
+        await delivery.sender.close()
+    if outbox.OUTBOX_ENABLED:
+        await outbox.close()
+    await history.close()
+    if task is not None:
+        try:
+            await task
+        except asyncio.CancelledError:
+            logger.info("Bot task cancelled cleanly.")
 
-    try:
-        await bot.close()
-        logger.info("Bot closed.")
-    except Exception as e:
-        logger.warning(f"Error during bot close: {e}")
+        try:
+            await delivery.bot.close()
+            logger.info("Bot closed.")
+        except Exception as e:
+            logger.warning(f"Error during bot close: {e}")
     try:
         await pool.close()
         logger.info("Database pool closed.")
@@ -51,6 +123,25 @@ async def lifespan(app: FastAPI):
         
 app = FastAPI(lifespan=lifespan)
 
+Gauge("alert_queue_depth", "Alerts waiting in the ingest queue", queue.qsize)
+Gauge("alert_queue_oldest_age_seconds", "Age of the oldest alert in the ingest queue", queue.oldest_age)
+CallbackCounter("alert_queue_shed_total", "Alerts rejected or dropped by the ingest queue", lambda: queue.rejected + queue.dropped)
+Gauge("alert_queue_server_depth", "Queued alerts of the servers with the most queued", lambda: {(str(k),): v for k, v in queue.tenant_depths().items()}, ("server",))
+Gauge("webhook_throttled", "Webhook alerts over the server's rate limit, for the most throttled servers", lambda: {(str(k),): v for k, v in limiter.throttled.most_common(10)}, ("server",))
+if delivery is not None:
+    Gauge("dispatcher_in_flight", "Alerts taken from the ingest queue and not yet processed", delivery.in_flight)
+    Gauge("shard_ready", "Whether each local gateway shard is connected", lambda: {(k,): int(v["ready"]) for k, v in delivery.shard_stats().items()}, ("shard",))
+    Gauge("shard_queue_depth", "Alerts waiting for each local shard", lambda: {(k,): v["waiting"] + sum(v["queued"]) for k, v in delivery.shard_stats().items()}, ("shard",))
+    CallbackCounter("shard_processed_total", "Alerts processed by each local shard's workers", lambda: {(k,): sum(v["processed"]) for k, v in delivery.shard_stats().items()}, ("shard",))
+    Gauge("sender_pending", "Embeds waiting in the send scheduler", lambda: delivery.sender.stats()["pending"])
+    Gauge("sender_coalescing_ratio", "Embeds per Discord message", lambda: delivery.sender.stats()["coalescing_ratio"])
+CallbackCounter("cache_hits_total", "Routing cache hits", lambda: {("server",): server_cache.hits}, ("cache",))
+CallbackCounter("cache_misses_total", "Routing cache misses", lambda: {("server",): server_cache.misses}, ("cache",))
+Gauge("subscriptions", "Channel subscriptions in the routing index", lambda: subscriptions.stats()["subscriptions"])
+CallbackCounter("log_records_dropped_total", "Log records dropped because the logging queue was full", lambda: log_handler.dropped)
+Gauge("db_pool", "Connection pool statistics from psycopg_pool", lambda: {(k,): v for k, v in pool.get_stats().items()}, ("stat",))
+Gauge("startup_seconds", "Seconds from import to each startup stage", lambda: {(k,): v for k, v in startup_times.items()}, ("stage",))
+
 
 @app.get('/')
 async def home():
@@ -58,14 +149,216 @@ async def home():
 
 @app.get('/health')
 async def health():
-    return {"status": "healthy"}
+    # Healthy as soon as webhooks are accepted; "startup" shows how far delivery has got
+    return {"status": "healthy", "role": ROLE, "startup": startup_times}
+
+@app.get('/metrics')
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get('/stats')
+async def stats():
+    stats = {
+        "startup": startup_times,
+        "rate_limits": limiter.stats(),
+        "db_pool": pool_stats(),
+        "dedup": dedup.stats(),
+        "logging": {"dropped": log_handler.dropped, "queued": log_handler.queue.qsize()},
+    }
+    if delivery is not None:
+        stats.update({
+            "server_cache": server_cache.stats(),
+            "subscriptions": subscriptions.stats(),
+            "shards": delivery.shard_stats(),
+            "supervisor": delivery.supervisor.stats(),
+            "sender": delivery.sender.stats(),
+            "history": history.stats(),
+            "market": market.stats(),
+            "digest": delivery.coalescer.stats(),
+            "templates": delivery.templates.stats(),
+            "prefixes": {"cached": len(prefixes), **prefix_stats},
+        })
+    return stats
+
+@app.get('/queue')
+async def queue_stats():
+    stats = queue.stats()
+    stats["in_flight"] = delivery.in_flight() if delivery is not None else 0
+    stats["rate_limits"] = limiter.stats()
+    stats["outbox"] = outbox.stats()
+    return stats
 
-@app.post('/webhook')
-async def webhook(payload: AlertPayload):
+# Hands an alert to the queue, or to the outbox writer in durable mode. Raises RateLimited for a
+# server over its rate and QueueFull when shedding load; in outbox mode returns a future that
+# resolves once the alert is stored
+def submit_alert(alert):
+    if ROLE == "delivery":
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="This instance only delivers alerts, send webhooks to an ingest instance")
+    charged = limiter.check(alert.server_id, alert.secret)
     try:
-        await queue.put(payload.model_dump(exclude_unset=True))
+        if outbox.OUTBOX_ENABLED:
+            # Same bound as the in-memory queue, so a slow or unreachable database sheds load too
+            if outbox.writer.backlog() >= QUEUE_MAX_SIZE:
+                raise asyncio.QueueFull()
+            return outbox.writer.add(alert)
+        queue.offer(alert)
+    except asyncio.QueueFull:
+        # Shed alerts do not count against the server's rate
+        limiter.refund(charged)
+        raise
+    return None
+
+# Request body schema for the docs, the body itself is decoded by the fast path in Alert
+ALERT_BODY = {"requestBody": {"required": True, "content": {"application/json": {"schema": AlertPayload.model_json_schema()}}}}
+
+def decode_alert(body):
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise AlertValidationError([{"loc": ["body"], "msg": f"Invalid JSON: {e}", "type": "json_invalid"}])
+    return Alert.from_dict(data, time.time())
+
+@app.post('/webhook', openapi_extra=ALERT_BODY)
+async def webhook(request: Request, idempotency_key: Optional[str] = Header(None)):
+    started = time.perf_counter()
+    context = None
+    try:
+        try:
+            alert = decode_alert(await request.body())
+        except AlertValidationError as e:
+            webhook_alerts_total.inc('invalid')
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors)
+        context = alert_id.set(alert.alert_id)
+        fp = None
+        if dedup.DEDUP_ENABLED:
+            fp = dedup.fingerprint(alert, idempotency_key)
+            if dedup.is_duplicate(fp):
+                webhook_alerts_total.inc('duplicate')
+                return {"status": "duplicate"}
+        stored = submit_alert(alert)
+        if fp is not None:
+            dedup.remember(fp)
+        if stored is not None:
+            # Durable mode: acknowledged once the alert's batch is committed to Postgres
+            try:
+                await stored
+            except Exception as e:
+                logger.error(f"Outbox write error: {e}")
+                webhook_alerts_total.inc('store_failed')
+                if fp is not None:
+                    dedup.forget(fp)
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Alert could not be stored", headers={"Retry-After": str(QUEUE_RETRY_AFTER)})
+        webhook_alerts_total.inc('accepted')
+        stage_seconds.observe(time.perf_counter() - started, 'webhook')
+        mark("first_webhook")
         # 200 Success
-        return {"status": "success"}
+        return {"status": "success", "alert_id": alert.alert_id}
+    except RateLimited as e:
+        # 429 This server is sending alerts faster than its rate limit
+        webhook_alerts_total.inc('throttled')
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Alert rate limit exceeded for this server", headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except TenantQueueFull:
+        # 429 Too many alerts queued for this server
+        webhook_alerts_total.inc('tenant_full')
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many queued alerts for this server", headers={"Retry-After": str(QUEUE_RETRY_AFTER)})
+    except asyncio.QueueFull:
+        # 503 Alert queue is full
+        webhook_alerts_total.inc('queue_full')
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Alert queue is full", headers={"Retry-After": str(QUEUE_RETRY_AFTER)})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Webhook error")
         raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+    finally:
+        if context is not None:
+            alert_id.reset(context)
+
+# Yields raw NDJSON lines as they stream in, or the items of a JSON array body
+async def read_batch(request):
+    content_type = request.headers.get('content-type', '')
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        buffer = b''
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+        return
+    try:
+        items = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array or an NDJSON body")
+    for item in items:
+        yield item
+
+@app.post('/webhook/batch')
+async def webhook_batch(request: Request):
+    started = time.perf_counter()
+    results = []
+    stored = []
+    index = 0
+    items = read_batch(request)
+    async for item in items:
+        if index >= BATCH_MAX_ITEMS:
+            # Stop reading: the rest of the body is neither parsed nor answered item by item
+            results.append({"index": index, "status": "rejected", "error": f"Batch limit of {BATCH_MAX_ITEMS} alerts exceeded, this and any later alerts were not read"})
+            break
+        try:
+            if isinstance(item, bytes):
+                alert = decode_alert(item)
+            else:
+                alert = Alert.from_dict(item, time.time())
+            fp = None
+            if dedup.DEDUP_ENABLED:
+                fp = dedup.fingerprint(alert)
+                if dedup.is_duplicate(fp):
+                    webhook_alerts_total.inc('duplicate')
+                    results.append({"index": index, "status": "duplicate"})
+                    index += 1
+                    continue
+            pending = submit_alert(alert)
+            if fp is not None:
+                dedup.remember(fp)
+            if pending is not None:
+                stored.append((len(results), pending, fp))
+            results.append({"index": index, "status": "accepted", "alert_id": alert.alert_id})
+            if pending is None:
+                webhook_alerts_total.inc('accepted')
+        except RateLimited as e:
+            webhook_alerts_total.inc('throttled')
+            results.append({"index": index, "status": "rejected", "error": "Alert rate limit exceeded for this server", "retry_after": math.ceil(e.retry_after)})
+        except TenantQueueFull:
+            webhook_alerts_total.inc('tenant_full')
+            results.append({"index": index, "status": "rejected", "error": "Too many queued alerts for this server"})
+        except asyncio.QueueFull:
+            webhook_alerts_total.inc('queue_full')
+            results.append({"index": index, "status": "rejected", "error": "Alert queue is full"})
+        except AlertValidationError as e:
+            webhook_alerts_total.inc('invalid')
+            results.append({"index": index, "status": "rejected", "error": "Invalid payload", "detail": e.errors})
+        index += 1
+    await items.aclose()
+
+    # Durable mode: wait for the whole batch to be committed together, only then count it accepted
+    for position, pending, fp in stored:
+        try:
+            await pending
+        except Exception as e:
+            logger.error(f"Outbox write error: {e}")
+            webhook_alerts_total.inc('store_failed')
+            if fp is not None:
+                dedup.forget(fp)
+            results[position] = {"index": results[position]["index"], "status": "rejected", "error": "Alert could not be stored"}
+            continue
+        webhook_alerts_total.inc('accepted')
+
+    stage_seconds.observe(time.perf_counter() - started, 'webhook_batch')
+    accepted = sum(1 for r in results if r["status"] == "accepted")
+    duplicates = sum(1 for r in results if r["status"] == "duplicate")
+    return {"accepted": accepted, "duplicates": duplicates, "rejected": len(results) - accepted - duplicates, "results": results}
@@ -0,0 +1,180 @@
+import asyncio
+import base64
+import math
+import os
+import time
+from array import array
+from collections import OrderedDict
+import orjson
+from dotenv import load_dotenv
+from db import pool
+from shared import logger
+from shards import SHARD_IDS
+
+load_dotenv()
+
+MARKET_STATE_ENABLED = os.getenv("MARKET_STATE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Alerts kept per (server, ticker, interval), and how many keys are tracked before the least recent is evicted
+MARKET_WINDOW = int(os.getenv("MARKET_WINDOW", 50))
+MARKET_MAX_KEYS = int(os.getenv("MARKET_MAX_KEYS", 10000))
+MARKET_SNAPSHOT_SECONDS = float(os.getenv("MARKET_SNAPSHOT_SECONDS", 60))
+# Snapshots are kept in Postgres so they outlive the instance. Each delivery process has its own
+# row, keyed by the shards it serves, since it only sees those shards' alerts
+MARKET_SNAPSHOT_KEY = os.getenv("MARKET_SNAPSHOT_KEY") or "shards:" + ",".join(str(s) for s in SHARD_IDS)
+
+MARKET_DDL = '''--begin-sql
+        CREATE TABLE IF NOT EXISTS market_state (
+        key TEXT PRIMARY KEY,
+        snapshot BYTEA NOT NULL,
+        saved_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+'''
+
+# Fixed-size ring of recent alert prices for one (server, ticker, interval), stored in flat double
+# arrays so a key costs 4 * window * 8 bytes however many alerts it has seen
+class PriceRing:
+    __slots__ = ('times', 'closes', 'highs', 'lows', 'head', 'count')
+
+    def __init__(self, window=MARKET_WINDOW):
+        self.times = array('d', bytes(8 * window))
+        self.closes = array('d', bytes(8 * window))
+        self.highs = array('d', bytes(8 * window))
+        self.lows = array('d', bytes(8 * window))
+        self.head = 0
+        self.count = 0
+
+    def last_close(self):
+        if not self.count:
+            return None
+        return self.closes[self.head - 1]
+
+    def add(self, when, close, high, low):
+        window = len(self.times)
+        self.times[self.head] = when
+        self.closes[self.head] = close
+        self.highs[self.head] = high
+        self.lows[self.head] = low
+        self.head = (self.head + 1) % window
+        self.count = min(self.count + 1, window)
+
+    # Rolling low/high and alerts per hour over the samples held. max()/min() over the arrays run
+    # in C; only the filled part is sliced out until the ring has wrapped once
+    def summary(self):
+        window = len(self.times)
+        if self.count < window:
+            highs, lows, times = self.highs[:self.count], self.lows[:self.count], self.times[:self.count]
+        else:
+            highs, lows, times = self.highs, self.lows, self.times
+        low, high = min(lows), max(highs)
+        span = max(times) - min(times)
+        per_hour = (self.count - 1) * 3600 / span if span > 0 else None
+        return low, high, per_hour
+
+    def dump(self):
+        raw = self.times.tobytes() + self.closes.tobytes() + self.highs.tobytes() + self.lows.tobytes()
+        return [self.head, self.count, base64.b64encode(raw).decode()]
+
+    @classmethod
+    def load(cls, head, count, raw, window=MARKET_WINDOW):
+        values = array('d')
+        values.frombytes(base64.b64decode(raw))
+        saved = len(values) // 4
+        ring = cls(window)
+        # Replay oldest to newest so a changed MARKET_WINDOW keeps the most recent samples
+        for i in range(count):
+            j = (head - count + i) % saved
+            ring.add(values[j], values[saved + j], values[2 * saved + j], values[3 * saved + j])
+        return ring
+
+# (server_id, ticker, interval) -> PriceRing, least recently updated first. Per server, so one
+# server's alerts never show up in (or reveal their rate through) another server's embeds
+rings = OrderedDict()
+evicted = 0
+
+# Records an alert's prices and returns (change_pct, low, high, per_hour, samples) for its embed,
+# or None for alerts without a usable close price. change_pct is since the previous alert for the key.
+# NaN and infinite prices (accepted by the payload parser) would poison the whole window, so they are skipped
+def record(alert, now=None):
+    global evicted
+    if not MARKET_STATE_ENABLED or alert.close is None or not math.isfinite(alert.close):
+        return None
+    key = (alert.server_id, alert.ticker, alert.interval or '')
+    ring = rings.get(key)
+    if ring is None:
+        ring = rings[key] = PriceRing()
+        if len(rings) > MARKET_MAX_KEYS:
+            rings.popitem(last=False)
+            evicted += 1
+    else:
+        rings.move_to_end(key)
+    previous = ring.last_close()
+    close = alert.close
+    high, low = alert.high, alert.low
+    ring.add(alert.received or now or time.time(), close,
+             high if high is not None and math.isfinite(high) else close,
+             low if low is not None and math.isfinite(low) else close)
+    change = (close - previous) / previous * 100 if previous else None
+    low, high, per_hour = ring.summary()
+    return change, low, high, per_hour, ring.count
+
+def snapshot():
+    return orjson.dumps([[server_id, ticker, interval, *ring.dump()] for (server_id, ticker, interval), ring in rings.items()])
+
+async def init_schema():
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(MARKET_DDL)
+        await conn.commit()
+
+async def save():
+    if not MARKET_STATE_ENABLED:
+        return
+    data = snapshot()
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute('''
+                        INSERT INTO market_state (key, snapshot, saved_at)
+                        VALUES (%s, %s, now())
+                        ON CONFLICT (key) DO UPDATE SET snapshot = EXCLUDED.snapshot, saved_at = EXCLUDED.saved_at;
+                        ''', (MARKET_SNAPSHOT_KEY, data))
+        await conn.commit()
+
+async def load():
+    if not MARKET_STATE_ENABLED:
+        return
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT snapshot FROM market_state WHERE key = %s;", (MARKET_SNAPSHOT_KEY,))
+                res = await cur.fetchone()
+        if res is None:
+            return
+        entries = orjson.loads(bytes(res[0]))
+        rings.clear()
+        for entry in entries[-MARKET_MAX_KEYS:]:
+            # Snapshots from before the state was kept per server have no server id, start those afresh
+            if len(entry) != 6:
+                continue
+            server_id, ticker, interval, head, count, raw = entry
+            rings[(server_id, ticker, interval)] = PriceRing.load(head, count, raw)
+        logger.info(f"Loaded market state for {len(rings)} tickers.")
+    except Exception as e:
+        logger.error(f"Could not load market state snapshot: {e}")
+
+async def snapshot_loop():
+    while True:
+        await asyncio.sleep(MARKET_SNAPSHOT_SECONDS)
+        try:
+            await save()
+        except Exception as e:
+            logger.error(f"Market state snapshot error: {e}")
+
+def stats():
+    return {
+        "enabled": MARKET_STATE_ENABLED,
+        "keys": len(rings),
+        "max_keys": MARKET_MAX_KEYS,
+        "window": MARKET_WINDOW,
+        "bytes": len(rings) * 4 * 8 * MARKET_WINDOW,
+        "evicted": evicted,
+    }
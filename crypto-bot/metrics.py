@@ -0,0 +1,123 @@
+import bisect
+
+# Minimal Prometheus text-format metrics. Observing is a bisect and two additions, so it is
+# cheap enough to leave on for every alert
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+registry = []
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+# Gauges are read at scrape time from a callback returning {labelvalues: value}, or a number
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, callback, labelnames=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelnames = labelnames
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labelvalues, value in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+# A count kept elsewhere that only goes up, read at scrape time like a Gauge
+class CallbackCounter(Gauge):
+    kind = "counter"
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}
+        registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        series = self.series.get(labelvalues)
+        if series is None:
+            # [per-bucket counts (+Inf last), sum, count]
+            series = self.series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    # Estimate a quantile from the bucket counts, interpolating inside the bucket like histogram_quantile()
+    def quantile(self, q, *labelvalues):
+        series = self.series.get(labelvalues)
+        if not series or not series[2]:
+            return 0.0
+        rank = q * series[2]
+        seen = 0
+        for i, count in enumerate(series[0]):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {count}")
+        # Precomputed p50/p95/p99 for dashboards that do not run histogram_quantile()
+        quantile_name = f"{self.name}_quantile"
+        lines += [f"# HELP {quantile_name} Estimated quantiles of {self.name}", f"# TYPE {quantile_name} gauge"]
+        for labelvalues in self.series:
+            for q in QUANTILES:
+                value = self.quantile(q, *labelvalues)
+                lines.append(f"{quantile_name}{_labels(self.labelnames, labelvalues, [('quantile', q)])} {value}")
+        return lines
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+# Pipeline stages: webhook, queue (receipt to a worker picking the alert up), db, embed,
+# send (scheduler queue plus the Discord call) and end_to_end (receipt to delivery)
+stage_seconds = Histogram("alert_stage_seconds", "Time spent by alerts in each pipeline stage", ("stage",))
+webhook_alerts_total = Counter("webhook_alerts_total", "Alerts received on the webhooks by result", ("result",))
+alerts_total = Counter("alerts_total", "Alerts processed by the consumers by outcome", ("outcome",))
+discord_send_seconds = Histogram("discord_send_seconds", "Duration of Discord message send calls")
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional
+from logs import new_alert_id
 
 class AlertPayload(BaseModel):
     server_id: int
@@ -13,4 +14,105 @@ class AlertPayload(BaseModel):
     high: Optional[float] = None
     low: Optional[float] = None
     interval: Optional[str] = None
-    exchange: Optional[str] = None
\ No newline at end of file
+    exchange: Optional[str] = None
+
+class AlertValidationError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{e['loc'][0]}: {e['msg']}" for e in errors))
+
+# Postgres BIGINT, which server ids are stored (and cast to) as
+BIGINT_MIN = -2 ** 63
+BIGINT_MAX = 2 ** 63 - 1
+
+def _to_int(value):
+    try:
+        if isinstance(value, int):
+            result = int(value)
+        elif isinstance(value, float) and value.is_integer():
+            result = int(value)
+        elif isinstance(value, str):
+            result = int(value.strip())
+        else:
+            result = None
+    except ValueError:
+        result = None
+    if result is None:
+        raise ValueError("Input should be a valid integer")
+    if not BIGINT_MIN <= result <= BIGINT_MAX:
+        raise ValueError("Input should be a 64-bit integer")
+    return result
+
+def _to_float(value):
+    try:
+        if isinstance(value, (int, float, str)):
+            return float(value)
+    except ValueError:
+        pass
+    raise ValueError("Input should be a valid number")
+
+def _to_str(value):
+    if isinstance(value, str):
+        return value
+    raise ValueError("Input should be a valid string")
+
+# Fast-path schema, mirroring AlertPayload's lax coercion: (field, converter, required)
+ALERT_SCHEMA = (
+    ('server_id', _to_int, True),
+    ('ticker', _to_str, True),
+    ('alert', _to_str, True),
+    ('secret', _to_str, False),
+    ('signal_type', _to_str, False),
+    ('time', _to_str, False),
+    ('open', _to_float, False),
+    ('close', _to_float, False),
+    ('high', _to_float, False),
+    ('low', _to_float, False),
+    ('interval', _to_str, False),
+    ('exchange', _to_str, False),
+)
+ALERT_FIELDS = tuple(name for name, _, _ in ALERT_SCHEMA)
+
+# Compact queued alert: payload fields (None when not sent) plus pipeline bookkeeping
+class Alert:
+    __slots__ = ALERT_FIELDS + ('received', 'outbox_id', 'alert_id')
+
+    def __init__(self, values, received=None, outbox_id=None, alert_id=None):
+        for name, value in zip(ALERT_FIELDS, values):
+            setattr(self, name, value)
+        self.received = received
+        self.outbox_id = outbox_id
+        # Correlation id carried into every log line about this alert
+        self.alert_id = alert_id or new_alert_id()
+
+    @classmethod
+    def from_dict(cls, data, received=None, alert_id=None):
+        if not isinstance(data, dict):
+            raise AlertValidationError([{"loc": ["body"], "msg": "Input should be a JSON object", "type": "dict_type"}])
+        values = []
+        errors = None
+        for name, convert, required in ALERT_SCHEMA:
+            value = data.get(name)
+            if value is None:
+                if required:
+                    errors = errors or []
+                    errors.append({"loc": [name], "msg": "Field required", "type": "missing"})
+                values.append(None)
+                continue
+            try:
+                values.append(convert(value))
+            except ValueError as e:
+                errors = errors or []
+                errors.append({"loc": [name], "msg": str(e), "type": "value_error"})
+                values.append(None)
+        if errors:
+            raise AlertValidationError(errors)
+        return cls(values, received, alert_id=alert_id)
+
+    # Payload fields that were sent, the same shape as AlertPayload.model_dump(exclude_unset=True)
+    def to_dict(self):
+        return {name: getattr(self, name) for name in ALERT_FIELDS if getattr(self, name) is not None}
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.to_dict().items() if k != 'secret')
+        return f"Alert({fields})"
@@ -0,0 +1,273 @@
+import asyncio
+import os
+import psycopg
+from dotenv import load_dotenv
+from psycopg.types.json import Jsonb
+from db import pool, conninfo
+from shared import logger, ROLE
+from batch_writer import BatchWriter
+from models import Alert, AlertValidationError
+from shards import shard_for, SHARD_IDS, SHARD_COUNT
+
+load_dotenv()
+
+# Split ingest/delivery deployments hand alerts over through the outbox, so it is always on there.
+# So is a process serving only some of the shards, webhooks for the others reach it too
+OUTBOX_ENABLED = ROLE != "all" or len(SHARD_IDS) < SHARD_COUNT or os.getenv("OUTBOX_ENABLED", "false").lower() in ("1", "true", "yes")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_FLUSH_MS = int(os.getenv("OUTBOX_FLUSH_MS", 20))
+OUTBOX_CLAIM_BATCH = int(os.getenv("OUTBOX_CLAIM_BATCH", 100))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", 60))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 1))
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", 24))
+# How long a batch waits for the table to be created at startup before its webhooks get a 503
+OUTBOX_SCHEMA_WAIT_SECONDS = float(os.getenv("OUTBOX_SCHEMA_WAIT_SECONDS", 10))
+OUTBOX_CLOSE_TIMEOUT = float(os.getenv("OUTBOX_CLOSE_TIMEOUT", 10))
+NOTIFY_CHANNEL = "alert_outbox"
+
+# dead_at is set on rows that ran out of attempts; they are kept for inspection until the retention prune
+OUTBOX_DDL = '''--begin-sql
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        payload JSONB NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        claimed_at TIMESTAMPTZ,
+        attempts INT DEFAULT 0,
+        delivered_at TIMESTAMPTZ
+        );
+        ALTER TABLE alert_outbox ADD COLUMN IF NOT EXISTS shard INT NOT NULL DEFAULT 0;
+        ALTER TABLE alert_outbox ADD COLUMN IF NOT EXISTS dead_at TIMESTAMPTZ;
+        DROP INDEX IF EXISTS alert_outbox_pending_idx;
+        DROP INDEX IF EXISTS alert_outbox_shard_pending_idx;
+        CREATE INDEX IF NOT EXISTS alert_outbox_shard_live_idx
+        ON alert_outbox (shard, id) WHERE delivered_at IS NULL AND dead_at IS NULL;
+'''
+
+CLAIM_SQL = '''
+        UPDATE alert_outbox
+        SET claimed_at = now(), attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM alert_outbox
+            WHERE delivered_at IS NULL
+            AND dead_at IS NULL
+            AND shard = ANY(%s)
+            AND attempts < %s
+            AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => %s))
+            AND NOT id = ANY(%s)
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, payload;
+'''
+
+# Set once the table exists; webhooks accepted before that are written when it is
+schema_ready = asyncio.Event()
+
+async def _insert(alerts):
+    if not schema_ready.is_set():
+        try:
+            await asyncio.wait_for(schema_ready.wait(), OUTBOX_SCHEMA_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Outbox table not ready after {OUTBOX_SCHEMA_WAIT_SECONDS:g}s")
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Each delivery process claims only the rows of the shards it connects
+            async with cur.copy("COPY alert_outbox (payload, shard) FROM STDIN") as copy:
+                for alert in alerts:
+                    payload = alert.to_dict()
+                    payload['_received'] = alert.received
+                    payload['_alert_id'] = alert.alert_id
+                    await copy.write_row((Jsonb(payload), shard_for(alert.server_id)))
+            # Delivered on commit, wakes delivery workers in other processes
+            await cur.execute(f"NOTIFY {NOTIFY_CHANNEL}")
+        await conn.commit()
+    # Pick the new rows up right away instead of waiting for the next poll
+    wakeup.set()
+
+async def init_schema():
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(OUTBOX_DDL)
+            # Pending rows written before the shard column existed, or under another SHARD_COUNT
+            await cur.execute('''
+                        UPDATE alert_outbox
+                        SET shard = ((payload->>'server_id')::bigint >> 22) %% %s
+                        WHERE delivered_at IS NULL
+                        AND dead_at IS NULL
+                        AND shard <> ((payload->>'server_id')::bigint >> 22) %% %s;
+                        ''', (SHARD_COUNT, SHARD_COUNT))
+        await conn.commit()
+    schema_ready.set()
+
+async def _mark_delivered(ids):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute('''
+                        UPDATE alert_outbox
+                        SET delivered_at = now()
+                        WHERE id = ANY(%s);
+                        ''', (ids,))
+        await conn.commit()
+    claimed.difference_update(ids)
+
+writer = BatchWriter(_insert, OUTBOX_BATCH_SIZE, OUTBOX_FLUSH_MS / 1000, name="outbox")
+acks = BatchWriter(_mark_delivered, OUTBOX_BATCH_SIZE, OUTBOX_FLUSH_MS / 1000, name="outbox ack")
+wakeup = asyncio.Event()
+# Rows claimed by this process and not yet delivered, released again on shutdown
+claimed = set()
+# Rows of this process's shards given up on after OUTBOX_MAX_ATTEMPTS
+dead_lettered = 0
+
+def ack(outbox_id):
+    acks.add_nowait(outbox_id)
+
+# A claimed row whose delivery failed: claimable again once its lease expires
+def release(outbox_id):
+    claimed.discard(outbox_id)
+
+async def claim(shard_ids=SHARD_IDS, limit=OUTBOX_CLAIM_BATCH):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Rows this process still holds may have outlived their lease while waiting on a busy
+            # channel; claiming them again would queue and post them twice
+            await cur.execute(CLAIM_SQL, (shard_ids, OUTBOX_MAX_ATTEMPTS, OUTBOX_LEASE_SECONDS, list(claimed), limit))
+            rows = await cur.fetchall()
+        await conn.commit()
+    rows.sort()
+    claimed.update(row[0] for row in rows)
+    return rows
+
+# Feeds claimed outbox rows into the in-memory queue. Undelivered rows left over from a
+# previous process (unclaimed, or with an expired lease) are replayed the same way
+async def claim_loop(queue, gateway=None):
+    logger.info("✅ Outbox claim loop started.")
+    replayed = False
+    while True:
+        # Claiming for a shard whose gateway is down would let leases expire under us, so only the
+        # connected shards' rows are claimed; a reconnecting shard does not hold up the others
+        shard_ids = SHARD_IDS
+        if gateway is not None:
+            if not gateway.any_up.is_set():
+                await gateway.any_up.wait()
+            shard_ids = gateway.connected()
+        try:
+            wakeup.clear()
+            rows = await claim(shard_ids)
+            if rows and not replayed:
+                logger.info(f"Outbox: replaying {len(rows)} undelivered alerts.")
+            replayed = True
+            for outbox_id, payload in rows:
+                try:
+                    alert = Alert.from_dict(payload, payload.get('_received'), payload.get('_alert_id'))
+                except AlertValidationError as e:
+                    logger.error(f"Outbox: dropping invalid alert {outbox_id}: {e}")
+                    ack(outbox_id)
+                    continue
+                alert.outbox_id = outbox_id
+                await queue.put(alert)
+            if len(rows) == OUTBOX_CLAIM_BATCH:
+                continue
+        except Exception as e:
+            logger.error(f"Outbox claim error: {e}")
+        try:
+            await asyncio.wait_for(wakeup.wait(), OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+# LISTEN needs a dedicated connection that stays open, so this one is not taken from the pool
+async def listen_loop():
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                logger.info("✅ Listening for outbox notifications.")
+                # Catch up on anything written while we were not listening
+                wakeup.set()
+                async for _ in conn.notifies():
+                    wakeup.set()
+        except Exception as e:
+            logger.error(f"Outbox listen error: {e}")
+        await asyncio.sleep(5)
+
+# Rows whose last attempt's lease has expired without a delivery, and that this process no longer
+# holds, are never claimed again
+async def dead_letter():
+    global dead_lettered
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute('''
+                        UPDATE alert_outbox
+                        SET dead_at = now()
+                        WHERE delivered_at IS NULL
+                        AND dead_at IS NULL
+                        AND shard = ANY(%s)
+                        AND attempts >= %s
+                        AND claimed_at < now() - make_interval(secs => %s)
+                        AND NOT id = ANY(%s)
+                        RETURNING id;
+                        ''', (SHARD_IDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_LEASE_SECONDS, list(claimed)))
+            rows = await cur.fetchall()
+        await conn.commit()
+    if rows:
+        dead_lettered += len(rows)
+        ids = [row[0] for row in rows]
+        claimed.difference_update(ids)
+        logger.error(f"Outbox: gave up on {len(rows)} alerts after {OUTBOX_MAX_ATTEMPTS} attempts: {ids}")
+
+async def dead_letter_loop():
+    while True:
+        await asyncio.sleep(OUTBOX_LEASE_SECONDS)
+        try:
+            await dead_letter()
+        except Exception as e:
+            logger.error(f"Outbox dead letter error: {e}")
+
+# Delivered and dead-lettered rows are both kept for OUTBOX_RETENTION_HOURS
+async def prune():
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute('''
+                        DELETE FROM alert_outbox
+                        WHERE delivered_at < now() - make_interval(hours => %s)
+                        OR dead_at < now() - make_interval(hours => %s);
+                        ''', (OUTBOX_RETENTION_HOURS, OUTBOX_RETENTION_HOURS))
+        await conn.commit()
+
+async def prune_loop():
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            await prune()
+        except Exception as e:
+            logger.error(f"Outbox prune error: {e}")
+
+async def close():
+    # Nothing can be written before the schema exists, fail those webhooks instead of waiting
+    await writer.close(OUTBOX_CLOSE_TIMEOUT if schema_ready.is_set() else 0)
+    await acks.close(OUTBOX_CLOSE_TIMEOUT)
+    if not claimed:
+        return
+    # Let another process pick up what we claimed but did not deliver
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('''
+                            UPDATE alert_outbox
+                            SET claimed_at = NULL
+                            WHERE id = ANY(%s) AND delivered_at IS NULL;
+                            ''', (list(claimed),))
+            await conn.commit()
+        logger.info(f"Outbox: released {len(claimed)} undelivered alerts.")
+    except Exception as e:
+        logger.warning(f"Error releasing outbox claims: {e}")
+
+def stats():
+    return {
+        "enabled": OUTBOX_ENABLED,
+        "writer": writer.stats(),
+        "acks": acks.stats(),
+        "claimed": len(claimed),
+        "dead_lettered": dead_lettered,
+    }
@@ -0,0 +1,152 @@
+import asyncio
+import hmac
+import os
+import time
+from collections import Counter, OrderedDict
+from dotenv import load_dotenv
+from db import pool
+from shared import logger
+
+load_dotenv()
+
+# Alerts per minute each server may send to /webhook, and how many can arrive back to back.
+# A server admin can change their rate with !set ratelimit, up to WEBHOOK_RATE_MAX
+WEBHOOK_RATE = int(os.getenv("WEBHOOK_RATE", 120))
+WEBHOOK_RATE_MAX = int(os.getenv("WEBHOOK_RATE_MAX", 600))
+WEBHOOK_BURST = int(os.getenv("WEBHOOK_BURST", 30))
+WEBHOOK_LIMIT_MAX_KEYS = int(os.getenv("WEBHOOK_LIMIT_MAX_KEYS", 10000))
+WEBHOOK_LIMIT_REFRESH = float(os.getenv("WEBHOOK_LIMIT_REFRESH", 60))
+
+LOAD_QUERY = '''
+        SELECT server_id, webhook_rate, secret
+        FROM servers
+        WHERE webhook_rate IS NOT NULL OR secret IS NOT NULL
+'''
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+# Non-blocking token bucket: the webhook either takes a token or is told how long until one is free
+class Bucket:
+    __slots__ = ('tokens', 'capacity', 'fill_rate', 'updated')
+
+    def __init__(self, per_minute, burst, now):
+        self.capacity = max(1, min(burst, per_minute))
+        self.tokens = float(self.capacity)
+        self.fill_rate = per_minute / 60
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.fill_rate
+
+class IngestLimiter:
+    def __init__(self, rate=WEBHOOK_RATE, burst=WEBHOOK_BURST, max_keys=WEBHOOK_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # server_id -> alerts per minute, for servers that changed theirs
+        self.rates = {}
+        # server_id -> webhook secret, for servers that set one. Delivery still checks secrets;
+        # here they only decide which bucket an alert is charged to
+        self.secrets = {}
+        # server_id -> Bucket, least recently used first so unknown ids cannot grow it unbounded
+        self.buckets = OrderedDict()
+        # Per server for the servers tracked, and in total
+        self.throttled = Counter()
+        self.throttled_total = 0
+
+    def rate_for(self, server_id):
+        return self.rates.get(server_id, self.rate)
+
+    def authenticated(self, server_id, secret):
+        saved = self.secrets.get(server_id)
+        if saved is None:
+            return True
+        secret = secret.strip() if secret is not None else None
+        return bool(secret) and hmac.compare_digest(secret, saved)
+
+    # Raises RateLimited when the server is over its rate. Alerts without the server's secret are
+    # charged to a bucket of their own, so anyone knowing a server id cannot use up its real alerts'
+    # budget. Returns the bucket key charged, for refund()
+    def check(self, server_id, secret=None, now=None):
+        rate = self.rate_for(server_id)
+        if rate <= 0:
+            return None
+        key = server_id if self.authenticated(server_id, secret) else (server_id, 'unauthenticated')
+        now = now or time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(rate, self.burst, now)
+            if len(self.buckets) > self.max_keys:
+                evicted, _ = self.buckets.popitem(last=False)
+                self.throttled.pop(evicted, None)
+        else:
+            self.buckets.move_to_end(key)
+        wait = bucket.take(now)
+        if wait:
+            self.throttled[server_id] += 1
+            self.throttled_total += 1
+            raise RateLimited(wait)
+        return key
+
+    # Gives back the token of an alert that was charged but then not accepted
+    def refund(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+    def set(self, server_id, rate):
+        if rate is None:
+            self.rates.pop(server_id, None)
+        else:
+            self.rates[server_id] = rate
+        # Rebuilt at the new rate on the next alert
+        self.buckets.pop(server_id, None)
+        self.buckets.pop((server_id, 'unauthenticated'), None)
+
+    def set_secret(self, server_id, secret):
+        if secret is None:
+            self.secrets.pop(server_id, None)
+        else:
+            self.secrets[server_id] = secret
+
+    async def load(self):
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(LOAD_QUERY)
+                rows = await cur.fetchall()
+        rates = {server_id: rate for server_id, rate, _ in rows if rate is not None}
+        changed = {server_id for server_id in rates.keys() | self.rates.keys() if rates.get(server_id) != self.rates.get(server_id)}
+        self.rates = rates
+        self.secrets = {server_id: secret for server_id, _, secret in rows if secret is not None}
+        for server_id in changed:
+            self.buckets.pop(server_id, None)
+            self.buckets.pop((server_id, 'unauthenticated'), None)
+        return len(rows)
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(WEBHOOK_LIMIT_REFRESH)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Webhook rate limit refresh error: {e}")
+
+    def stats(self, top=10):
+        return {
+            "default_per_minute": self.rate,
+            "burst": self.burst,
+            "custom_rates": len(self.rates),
+            "tracked_servers": len(self.buckets),
+            "throttled": self.throttled_total,
+            "top_throttled": {str(server_id): count for server_id, count in self.throttled.most_common(top)},
+        }
+
+limiter = IngestLimiter()
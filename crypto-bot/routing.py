@@ -0,0 +1,140 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from db import pool
+from shared import logger
+
+load_dotenv()
+
+# Other processes (split delivery, shards) pick up channel changes on this interval
+ROUTE_INDEX_REFRESH = float(os.getenv("ROUTE_INDEX_REFRESH", 60))
+
+ANY = '*'
+
+LOAD_QUERY = '''
+        SELECT server_id, channel_id, ticker, signal_type, exchange
+        FROM channels
+'''
+
+# One server's subscriptions. Exact tickers and BTC*-style prefixes are both hashed, so matching
+# an alert is one lookup per prefix of its ticker, independent of how many patterns exist
+class ServerRoutes:
+    __slots__ = ('exact', 'prefixes')
+
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+
+    def _bucket(self, pattern):
+        if pattern.endswith(ANY):
+            return self.prefixes, pattern[:-1]
+        return self.exact, pattern
+
+    def add(self, pattern, signal_type, exchange, channel_id):
+        table, key = self._bucket(pattern)
+        subs = table.setdefault(key, set())
+        subs.add((signal_type, exchange, channel_id))
+
+    def remove(self, pattern, signal_type, exchange, channel_id=None):
+        table, key = self._bucket(pattern)
+        subs = table.get(key)
+        if not subs:
+            return
+        subs.difference_update([s for s in subs if s[0] == signal_type and s[1] == exchange and (channel_id is None or s[2] == channel_id)])
+        if not subs:
+            del table[key]
+
+    def match(self, ticker, signal_type, exchange, found):
+        candidates = [self.exact.get(ticker)]
+        if self.prefixes:
+            candidates.extend(self.prefixes.get(ticker[:i]) for i in range(len(ticker) + 1))
+        for subs in candidates:
+            if not subs:
+                continue
+            for sub_signal, sub_exchange, channel_id in subs:
+                if sub_signal != ANY and sub_signal != signal_type:
+                    continue
+                if sub_exchange != ANY and sub_exchange != exchange:
+                    continue
+                found.add(channel_id)
+
+    def __len__(self):
+        return sum(len(s) for s in self.exact.values()) + sum(len(s) for s in self.prefixes.values())
+
+# server_id -> ServerRoutes, built from the channels table and kept in step by the channel commands
+class SubscriptionIndex:
+    def __init__(self):
+        self.servers = {}
+        self.loaded = False
+        # Changes made while a load() is reading the table, one list per load in progress
+        self._journals = []
+
+    @staticmethod
+    def _add(servers, server_id, pattern, signal_type, exchange, channel_id):
+        routes = servers.get(server_id)
+        if routes is None:
+            routes = servers[server_id] = ServerRoutes()
+        routes.add(pattern, signal_type, exchange, channel_id)
+
+    @staticmethod
+    def _remove(servers, server_id, pattern, signal_type, exchange, channel_id=None):
+        routes = servers.get(server_id)
+        if routes is not None:
+            routes.remove(pattern, signal_type, exchange, channel_id)
+
+    def add(self, server_id, pattern, signal_type, exchange, channel_id):
+        self._add(self.servers, server_id, pattern, signal_type, exchange, channel_id)
+        for journal in self._journals:
+            journal.append((self._add, (server_id, pattern, signal_type, exchange, channel_id)))
+
+    def remove(self, server_id, pattern, signal_type, exchange, channel_id=None):
+        self._remove(self.servers, server_id, pattern, signal_type, exchange, channel_id)
+        for journal in self._journals:
+            journal.append((self._remove, (server_id, pattern, signal_type, exchange, channel_id)))
+
+    # Channel ids subscribed to an alert: its exact ticker or a matching prefix, its signal
+    # ('NONE' for plain alerts) or any signal, its exchange or any exchange
+    def match(self, server_id, ticker, signal_type, exchange=None):
+        routes = self.servers.get(server_id)
+        found = set()
+        if routes is not None:
+            routes.match(ticker.upper(), signal_type, (exchange or '').upper(), found)
+        return found
+
+    async def load(self):
+        journal = []
+        self._journals.append(journal)
+        try:
+            async with pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(LOAD_QUERY)
+                    rows = await cur.fetchall()
+        finally:
+            self._journals.remove(journal)
+        servers = {}
+        for server_id, channel_id, pattern, signal_type, exchange in rows:
+            self._add(servers, server_id, pattern, signal_type, exchange or ANY, channel_id)
+        # The rows may predate a channel command that ran meanwhile, replay those on top
+        for apply, args in journal:
+            apply(servers, *args)
+        # Swapped in whole, so alerts never see a half-built index
+        self.servers = servers
+        self.loaded = True
+        return len(rows)
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(ROUTE_INDEX_REFRESH)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Subscription index refresh error: {e}")
+
+    def stats(self):
+        return {
+            "servers": len(self.servers),
+            "subscriptions": sum(len(r) for r in self.servers.values()),
+            "loaded": self.loaded,
+        }
+
+subscriptions = SubscriptionIndex()
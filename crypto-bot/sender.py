@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+from shared import logger
+from metrics import stage_seconds, discord_send_seconds
+
+load_dotenv()
+
+# Discord allows roughly 5 messages per 5 seconds per channel and 50 requests per second globally
+CHANNEL_RATE = int(os.getenv("SEND_CHANNEL_RATE", 5))
+CHANNEL_PER = float(os.getenv("SEND_CHANNEL_PER", 5))
+GLOBAL_RATE = int(os.getenv("SEND_GLOBAL_RATE", 50))
+GLOBAL_PER = float(os.getenv("SEND_GLOBAL_PER", 1))
+MAX_EMBEDS = 10
+# Discord's limit on the combined title, description, field and footer text of a message's embeds
+MAX_EMBED_CHARS = 6000
+SEND_MAX_PENDING = int(os.getenv("SEND_MAX_PENDING", 1000))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+
+class TokenBucket:
+    def __init__(self, rate, per):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.fill_rate)
+
+    # Honour a 429 retry_after from Discord
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+# Queues embeds per channel and sends them from one task per busy channel, packing up to
+# MAX_EMBEDS waiting embeds (and MAX_EMBED_CHARS of text) into each message and pacing sends
+# to the rate limit buckets
+class SendScheduler:
+    def __init__(self, channel_rate=CHANNEL_RATE, channel_per=CHANNEL_PER, global_rate=GLOBAL_RATE,
+                 global_per=GLOBAL_PER, max_embeds=MAX_EMBEDS, max_pending=SEND_MAX_PENDING):
+        self.channel_rate = channel_rate
+        self.channel_per = channel_per
+        self.global_bucket = TokenBucket(global_rate, global_per)
+        self.max_embeds = max_embeds
+        self.capacity = asyncio.Semaphore(max_pending)
+        self.buckets = {}
+        self.pending = {}
+        self.tasks = {}
+        self.messages = 0
+        self.embeds = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    # Queue an embed for a channel, with the id of its alert for logging. Waits while too many embeds are pending, then returns a
+    # future that resolves once the embed has been sent
+    async def submit(self, channel, embed, alert_id=None):
+        await self.capacity.acquire()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._done)
+        self.pending.setdefault(channel.id, deque()).append((embed, future, time.monotonic(), alert_id))
+        if channel.id not in self.tasks:
+            # A fresh context: the drain task sends for many alerts, its log lines must not carry
+            # the alert id of the one that happened to start it
+            self.tasks[channel.id] = asyncio.create_task(self._drain(channel), context=contextvars.Context())
+        return future
+
+    def _done(self, future):
+        self.capacity.release()
+        # Failures are logged in _drain, mark the exception retrieved for callers that ignore it
+        if not future.cancelled():
+            future.exception()
+
+    async def _drain(self, channel):
+        pending = self.pending[channel.id]
+        bucket = self.buckets.get(channel.id)
+        if bucket is None:
+            bucket = self.buckets[channel.id] = TokenBucket(self.channel_rate, self.channel_per)
+        retries = 0
+        try:
+            while pending:
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                batch = self._batch(pending)
+                try:
+                    started = time.perf_counter()
+                    await channel.send(embeds=[embed for embed, _, _, _ in batch])
+                    discord_send_seconds.observe(time.perf_counter() - started)
+                except Exception as e:
+                    retry_after = getattr(e, 'retry_after', None)
+                    if retry_after is not None and retries < SEND_MAX_RETRIES:
+                        # Rate limited: put the batch back in order and wait out the bucket
+                        self.rate_limited += 1
+                        retries += 1
+                        bucket.block(retry_after)
+                        pending.extendleft(reversed(batch))
+                        continue
+                    self.failed += len(batch)
+                    alert_ids = ', '.join(a for _, _, _, a in batch if a is not None)
+                    logger.error(f"Failed to send {len(batch)} alerts to channel {channel.id} (alert ids: {alert_ids or 'none'}): {e}")
+                    for _, future, _, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                retries = 0
+                now = time.monotonic()
+                self.messages += 1
+                self.embeds += len(batch)
+                for _, future, queued_at, _ in batch:
+                    latency = now - queued_at
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    stage_seconds.observe(latency, 'send')
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            del self.tasks[channel.id]
+            # Only non-empty if cancelled, fail what is left rather than leave callers hanging
+            for _, future, _, _ in self.pending.pop(channel.id):
+                future.cancel()
+
+    # The next message's embeds: as many waiting embeds as fit both limits. An embed over the
+    # character limit on its own is still sent alone, so Discord's error fails only that alert
+    def _batch(self, pending):
+        batch = [pending.popleft()]
+        size = len(batch[0][0])
+        while pending and len(batch) < self.max_embeds:
+            size += len(pending[0][0])
+            if size > MAX_EMBED_CHARS:
+                break
+            batch.append(pending.popleft())
+        return batch
+
+    async def close(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "messages": self.messages,
+            "embeds": self.embeds,
+            "coalescing_ratio": self.embeds / self.messages if self.messages else 0.0,
+            "avg_latency_seconds": self.latency_total / self.embeds if self.embeds else 0.0,
+            "max_latency_seconds": self.latency_max,
+            "pending": sum(len(p) for p in self.pending.values()),
+            "active_channels": len(self.tasks),
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+        }
@@ -0,0 +1,77 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from alert_queue import AlertQueue
+from shared import logger
+
+load_dotenv()
+
+# Total gateway shards, and the ones this process connects. Several processes with disjoint
+# SHARD_IDS split the guilds between them; every process (ingest included) needs the same SHARD_COUNT
+SHARD_COUNT = max(1, int(os.getenv("SHARD_COUNT", 1)))
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or list(range(SHARD_COUNT))
+SHARDED = SHARD_COUNT > 1
+
+if any(s < 0 or s >= SHARD_COUNT for s in SHARD_IDS):
+    raise RuntimeError(f"SHARD_IDS {SHARD_IDS} must be between 0 and SHARD_COUNT - 1 ({SHARD_COUNT - 1})")
+
+# The shard Discord delivers a guild's events on, and so the one whose gateway owns its channels
+def shard_for(guild_id, count=SHARD_COUNT):
+    return (guild_id >> 22) % count
+
+# Which local shards have a live gateway connection. all_up is set while every one of them does,
+# any_up while at least one does
+class GatewayState:
+    def __init__(self, shard_ids=SHARD_IDS):
+        self.ready = {shard_id: asyncio.Event() for shard_id in shard_ids}
+        self.all_up = asyncio.Event()
+        self.any_up = asyncio.Event()
+        self.disconnects = dict.fromkeys(shard_ids, 0)
+
+    def up(self, shard_id=None):
+        for s in self.ready if shard_id is None else (shard_id,):
+            self.ready[s].set()
+        self.any_up.set()
+        if all(event.is_set() for event in self.ready.values()):
+            self.all_up.set()
+
+    def down(self, shard_id=None):
+        for s in self.ready if shard_id is None else (shard_id,):
+            if self.ready[s].is_set():
+                logger.warning(f"Discord gateway shard {s} disconnected, holding its alerts until it reconnects.")
+                self.disconnects[s] += 1
+            self.ready[s].clear()
+        self.all_up.clear()
+        if not self.connected():
+            self.any_up.clear()
+
+    def connected(self):
+        return [s for s, event in self.ready.items() if event.is_set()]
+
+    async def wait(self, shard_id):
+        event = self.ready[shard_id]
+        if not event.is_set():
+            await event.wait()
+
+# Moves alerts from the shared ingest queue to the queue of the shard that owns their guild, so a
+# shard whose gateway is down holds only its own alerts while the others keep delivering. Only a
+# shard queue that fills up completely (QUEUE_MAX_SIZE) pushes back on the shared queue
+class ShardRouter:
+    def __init__(self, source, shard_ids=SHARD_IDS):
+        self.source = source
+        self.queues = {shard_id: AlertQueue() for shard_id in shard_ids}
+        self.misrouted = 0
+
+    async def run(self):
+        while True:
+            alert = await self.source.get()
+            try:
+                target = self.queues.get(shard_for(alert.server_id))
+                if target is None:
+                    # Only reachable when this process receives alerts it has no gateway for
+                    self.misrouted += 1
+                    logger.error(f"Alert for server {alert.server_id} belongs to shard {shard_for(alert.server_id)}, not served here.")
+                else:
+                    await target.put(alert)
+            finally:
+                self.source.task_done()
@@ -1,27 +1,58 @@
-import asyncio
 import logging
 import os
-import sys
 from fastapi import HTTPException, status
 from db import pool
+from alert_queue import AlertQueue
+from cache import invalidate_server
+from logs import setup_logging, sampled
 
-queue = asyncio.Queue()
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("discord.log", encoding="utf-8", mode="w"),
-    ]
-)
+# all: webhook and Discord delivery in one process. ingest / delivery: split tiers sharing the
+# Postgres outbox, so webhook intake and gateway connections scale separately
+ROLE = os.getenv("ROLE", "all")
+if ROLE not in ("all", "ingest", "delivery"):
+    raise RuntimeError(f"Unknown ROLE {ROLE}, expected all, ingest or delivery")
+
+queue = AlertQueue()
+log_handler, log_listener = setup_logging()
 
 logger = logging.getLogger(__name__)
 
+# Per-alert detail line, only logged for the LOG_SAMPLE_RATE share of alerts
+def trace(message, *args):
+    if sampled.get():
+        logger.info(message, *args)
+
+# guild id -> command prefix, None for guilds with no servers row (cached negatively)
+prefixes = {}
+prefix_stats = {"db_lookups": 0, "db_lookups_avoided": 0}
+
+async def load_prefixes():
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('SELECT server_id, prefix FROM servers')
+                rows = await cur.fetchall()
+        prefixes.clear()
+        prefixes.update(rows)
+        logger.info(f"Loaded prefixes for {len(rows)} servers.")
+    except Exception as e:
+        logger.error(f"DB error in load_prefixes: {e}")
+
+def cache_prefix(server_id, prefix):
+    prefixes[server_id] = prefix
+
+def invalidate_prefix(server_id):
+    prefixes.pop(server_id, None)
+
 # Helper methods for bot
 async def get_prefix(bot, message):
     if message.guild is None:
         return '!'
+    if message.guild.id in prefixes:
+        prefix_stats["db_lookups_avoided"] += 1
+        return prefixes[message.guild.id] or '!'
     try:
+        prefix_stats["db_lookups"] += 1
         async with pool.connection() as conn:
             async with conn.cursor() as cur:
                 await cur.execute('''
@@ -31,8 +62,10 @@ async def get_prefix(bot, message):
                 res = await cur.fetchone()
         if res is None:
             logger.info("ERROR: server not found in db!")
+            cache_prefix(message.guild.id, None)
             return '!'
         else:
+            cache_prefix(message.guild.id, res[0])
             return res[0]
     except Exception as e:
         logger.error(f"DB error in get_prefix: {e}")
@@ -48,6 +81,7 @@ async def toggle_alerts(server_id):
                             WHERE server_id = %s;
                             ''', (server_id,))
                 await conn.commit()
+                invalidate_server(server_id)
                 await cur.execute('''
                             SELECT alerts_on
                             FROM servers
@@ -64,18 +98,18 @@ async def toggle_alerts(server_id):
         logger.error(f"DB error in toggle_alerts: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal database error")
 
-async def set_channel(server_id, channel_id, ticker, signal=None):
+async def set_channel(server_id, channel_id, ticker, signal=None, exchange='*'):
     # Handles advanced signals
     signal_type = 'NONE' if signal is None else signal.upper()
     try:
         async with pool.connection() as conn:
             async with conn.cursor() as cur:
+                # A subscription can be sent to several channels, adding it again is a no-op
                 await cur.execute('''
-                            INSERT INTO channels (channel_id, server_id, ticker, signal_type)
-                            VALUES(%s, %s, %s, %s)
-                            ON CONFLICT (server_id, ticker, signal_type) DO UPDATE
-                            SET channel_id = EXCLUDED.channel_id
-                            ''', (channel_id, server_id, ticker.upper(), signal_type))
+                            INSERT INTO channels (channel_id, server_id, ticker, signal_type, exchange)
+                            VALUES(%s, %s, %s, %s, %s)
+                            ON CONFLICT (server_id, ticker, signal_type, exchange, channel_id) DO NOTHING
+                            ''', (channel_id, server_id, ticker.upper(), signal_type, exchange.upper()))
                 await conn.commit()
     except HTTPException:
         raise
@@ -98,12 +132,84 @@ async def set_secret(server_id, secret=None):
                             SET secret = EXCLUDED.secret
                             ''', (server_id, secret))
                 await conn.commit()
+                invalidate_server(server_id)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"DB error in set_secret: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal database error")
 
+async def set_digest_window(server_id, seconds):
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('''
+                            INSERT INTO servers (server_id, digest_window)
+                            VALUES(%s, %s)
+                            ON CONFLICT (server_id) DO UPDATE
+                            SET digest_window = EXCLUDED.digest_window
+                            ''', (server_id, seconds))
+                await conn.commit()
+                invalidate_server(server_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"DB error in set_digest_window: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal database error")
+
+# None goes back to the default WEBHOOK_RATE
+async def set_webhook_rate(server_id, per_minute):
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('''
+                            INSERT INTO servers (server_id, webhook_rate)
+                            VALUES(%s, %s)
+                            ON CONFLICT (server_id) DO UPDATE
+                            SET webhook_rate = EXCLUDED.webhook_rate
+                            ''', (server_id, per_minute))
+                await conn.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"DB error in set_webhook_rate: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal database error")
+
+# None goes back to the default template
+async def set_template(server_id, source):
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('''
+                            INSERT INTO servers (server_id, template)
+                            VALUES(%s, %s)
+                            ON CONFLICT (server_id) DO UPDATE
+                            SET template = EXCLUDED.template
+                            ''', (server_id, source))
+                await conn.commit()
+                # The template is read with the cached server row
+                invalidate_server(server_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"DB error in set_template: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal database error")
+
+async def get_template(server_id):
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('''
+                            SELECT template
+                            FROM servers
+                            WHERE server_id = %s;
+                            ''', (server_id,))
+                row = await cur.fetchone()
+                return row[0] if row else None
+    except Exception as e:
+        logger.error(f"DB error in get_template: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal database error")
+
 async def get_secret(server_id):
     try:
         async with pool.connection() as conn:
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import time
+import traceback
+from dotenv import load_dotenv
+from shared import logger
+
+load_dotenv()
+
+SUPERVISOR_BACKOFF_MIN = float(os.getenv("SUPERVISOR_BACKOFF_MIN", 1))
+SUPERVISOR_BACKOFF_MAX = float(os.getenv("SUPERVISOR_BACKOFF_MAX", 60))
+# A task that ran this long before failing starts over from the minimum backoff
+SUPERVISOR_HEALTHY_SECONDS = float(os.getenv("SUPERVISOR_HEALTHY_SECONDS", 60))
+
+# Owns a fixed set of long-running tasks, restarting any that crash or return with
+# exponential backoff until stop() is called
+class Supervisor:
+    def __init__(self, backoff_min=SUPERVISOR_BACKOFF_MIN, backoff_max=SUPERVISOR_BACKOFF_MAX):
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.specs = {}
+        self.tasks = {}
+        self.restarts = {}
+        self.last_error = {}
+
+    # `factory` is called with no arguments and returns the coroutine to run
+    def add(self, name, factory):
+        if name in self.specs:
+            raise ValueError(f"Task {name} is already supervised")
+        self.specs[name] = factory
+        self.restarts[name] = 0
+        self.last_error[name] = None
+
+    def start(self):
+        for name, factory in self.specs.items():
+            if name not in self.tasks:
+                self.tasks[name] = asyncio.create_task(self._supervise(name, factory), name=name)
+        logger.info(f"✅ Supervisor started {len(self.tasks)} tasks: {', '.join(self.tasks)}")
+
+    async def stop(self):
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks = {}
+
+    async def _supervise(self, name, factory):
+        backoff = self.backoff_min
+        while True:
+            started = time.monotonic()
+            try:
+                await factory()
+                self.last_error[name] = "exited"
+                logger.error(f"Supervised task {name} exited unexpectedly.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error[name] = repr(e)
+                logger.error(f"Supervised task {name} crashed: {e}")
+                logger.error(traceback.format_exc())
+            if time.monotonic() - started >= SUPERVISOR_HEALTHY_SECONDS:
+                backoff = self.backoff_min
+            self.restarts[name] += 1
+            logger.info(f"Restarting {name} in {backoff:.1f}s.")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.backoff_max)
+
+    def stats(self):
+        return {
+            name: {
+                "running": name in self.tasks and not self.tasks[name].done(),
+                "restarts": self.restarts[name],
+                "last_error": self.last_error[name],
+            }
+            for name in self.specs
+        }
@@ -0,0 +1,205 @@
+import os
+import string
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from discord import Embed
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Compiled templates kept, keyed by their source so servers with the same template share one
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", 1000))
+TEMPLATE_MAX_LENGTH = 2000
+
+# One `key: text` per line. field/line take `name | value`; field is shown inline, line full width.
+# A field is left out when any of its placeholders has no value for the alert
+DEFAULT_TEMPLATE = """title: 🚨 Alert: {ticker}
+description: {alert}
+color: #00b05e
+field: Advanced Signal | {signal}
+field: Exchange | {exchange}
+field: Time | {time}
+field: Interval | {interval}
+field: High | {high}
+field: Low | {low}
+field: Open | {open}
+field: Close | {close}
+field: Change | {change} since last alert
+field: Range | {range} (last {samples})
+field: Frequency | {per_hour} alerts/h
+footer: Source: TradingView webhooks"""
+
+# Title of an alert whose template left every part of the embed empty
+FALLBACK_TITLE = "🚨 Alert: "
+
+class TemplateError(ValueError):
+    pass
+
+@lru_cache(maxsize=1024)
+def format_time(value):
+    try:
+        return datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M UTC')
+    except Exception:
+        return value
+
+# Placeholder -> Python expression for its value (a str, or None when the alert has none) from
+# `alert`, its advanced signal `signal_type` ('NONE' for plain alerts) and its market `state` from
+# market.record. Templates are compiled into code that evaluates only the placeholders they use
+VALUES = {
+    'ticker': "alert.ticker",
+    'alert': "alert.alert",
+    'signal': "None if signal_type == 'NONE' else signal_type",
+    'exchange': "alert.exchange",
+    'interval': "alert.interval",
+    'time': "None if alert.time is None else format_time(alert.time)",
+    'open': "None if alert.open is None else str(alert.open)",
+    'close': "None if alert.close is None else str(alert.close)",
+    'high': "None if alert.high is None else str(alert.high)",
+    'low': "None if alert.low is None else str(alert.low)",
+    'change': "None if state is None or state[0] is None else f'{state[0]:+.2f}%'",
+    'range': "None if state is None else f'{state[1]:g} - {state[2]:g}'",
+    'per_hour': "None if state is None or state[3] is None else f'{state[3]:.1f}'",
+    'samples': "None if state is None else str(state[4])",
+}
+
+# Discord's limits for each part of an embed
+LIMITS = {'title': 256, 'description': 4096, 'footer': 2048, 'name': 256, 'value': 1024}
+MAX_FIELDS = 25
+
+# A piece of template text as a Python expression, plus the placeholders it needs
+class Text:
+    __slots__ = ('source', 'names', 'expression')
+
+    def __init__(self, source, limit):
+        names = []
+        parts = []
+        try:
+            for literal, name, spec, conversion in string.Formatter().parse(source):
+                if literal:
+                    parts.append(repr(literal))
+                if name is None:
+                    continue
+                # Only bare names, so a template cannot reach attributes or indexes of the values
+                if name not in VALUES or spec or conversion:
+                    raise TemplateError(f"Unknown placeholder {{{name}}}, use one of: {', '.join('{' + n + '}' for n in VALUES)}")
+                names.append(name)
+                parts.append(f"v_{name}")
+        except ValueError as e:
+            if isinstance(e, TemplateError):
+                raise
+            raise TemplateError(f"Invalid text {source!r}: {e}")
+        self.source = source
+        self.names = tuple(dict.fromkeys(names))
+        if not names:
+            self.expression = repr(source[:limit])
+        else:
+            self.expression = f"({' + '.join(parts)})[:{limit}]"
+
+    # Evaluates to None when a placeholder has no value
+    def code(self):
+        if not self.names:
+            return self.expression
+        present = ' and '.join(f"v_{name} is not None" for name in self.names)
+        return f"({self.expression} if {present} else None)"
+
+class Template:
+    def __init__(self, source):
+        if len(source) > TEMPLATE_MAX_LENGTH:
+            raise TemplateError(f"Templates can be at most {TEMPLATE_MAX_LENGTH} characters.")
+        self.source = source
+        self.title = None
+        self.description = None
+        self.footer = None
+        self.color = None
+        self.fields = []
+        for number, line in enumerate(source.splitlines(), 1):
+            if not line.strip():
+                continue
+            key, sep, text = line.partition(':')
+            key = key.strip().lower()
+            text = text.strip()
+            if not sep:
+                raise TemplateError(f"Line {number}: expected `key: text`, got {line!r}")
+            if key in ('title', 'description', 'footer'):
+                setattr(self, key, Text(text, LIMITS[key]))
+            elif key == 'color':
+                try:
+                    self.color = int(text.lstrip('#'), 16)
+                except ValueError:
+                    self.color = None
+                # Discord rejects embeds with a color outside 24-bit RGB
+                if self.color is None or not 0 <= self.color <= 0xFFFFFF:
+                    raise TemplateError(f"Line {number}: color must be a hex value from #000000 to #ffffff, like #00b05e")
+            elif key in ('field', 'line'):
+                name, sep, value = text.partition('|')
+                if not sep:
+                    raise TemplateError(f"Line {number}: expected `{key}: name | value`")
+                self.fields.append((Text(name.strip(), LIMITS['name']), Text(value.strip(), LIMITS['value']), key == 'field'))
+            else:
+                raise TemplateError(f"Line {number}: unknown key {key!r}, use title, description, color, field, line or footer")
+        if len(self.fields) > MAX_FIELDS:
+            raise TemplateError(f"Embeds can have at most {MAX_FIELDS} fields.")
+        if self.title is None and self.description is None and not self.fields:
+            raise TemplateError("A template needs a title, a description or at least one field.")
+        parts = [self.title, self.description, self.footer] + [text for field in self.fields for text in field[:2]]
+        self.names = tuple(dict.fromkeys(name for part in parts if part is not None for name in part.names))
+        self.code = self.generate()
+        namespace = {'Embed': Embed, 'format_time': format_time, 'FALLBACK_TITLE': FALLBACK_TITLE}
+        exec(compile(self.code, '<template>', 'exec'), namespace)
+        self.render = namespace['render']
+
+    # Python source for render(alert, signal_type='NONE', state=None) -> Embed. Template text only
+    # ever appears as string literals; placeholders are the expressions in VALUES
+    def generate(self):
+        lines = ["def render(alert, signal_type='NONE', state=None):"]
+        lines += [f"    v_{name} = {VALUES[name]}" for name in self.names]
+        lines.append("    data = {'type': 'rich'}")
+        if self.title is not None:
+            lines.append(f"    data['title'] = {self.title.code()} or ''")
+        if self.description is not None:
+            lines.append(f"    data['description'] = {self.description.code()} or ''")
+        if self.color is not None:
+            lines.append(f"    data['color'] = {self.color}")
+        lines.append("    fields = []")
+        for name, value, inline in self.fields:
+            indent = "    "
+            needed = name.names + tuple(n for n in value.names if n not in name.names)
+            if needed:
+                lines.append(f"    if {' and '.join(f'v_{n} is not None' for n in needed)}:")
+                indent += "    "
+            lines.append(f"{indent}name, value = {name.expression}, {value.expression}")
+            lines.append(f"{indent}if name and value:")
+            lines.append(f"{indent}    fields.append({{'name': name, 'value': value, 'inline': {inline}}})")
+        lines.append("    if fields:")
+        lines.append("        data['fields'] = fields")
+        if self.footer is not None:
+            lines.append(f"    footer = {self.footer.code()}")
+            lines.append("    if footer:")
+            lines.append("        data['footer'] = {'text': footer}")
+        # Discord rejects an embed with nothing in it, and the whole message it was batched into
+        lines.append("    if not data.get('title') and not data.get('description') and 'fields' not in data and 'footer' not in data:")
+        lines.append("        data['title'] = (FALLBACK_TITLE + alert.ticker)[:256]")
+        lines.append("    return Embed.from_dict(data)")
+        return "\n".join(lines) + "\n"
+
+compiled = OrderedDict()
+
+# The compiled template for a server's source text, None meaning the default
+def get(source=None):
+    source = source or DEFAULT_TEMPLATE
+    template = compiled.get(source)
+    if template is None:
+        template = compiled[source] = Template(source)
+        if len(compiled) > TEMPLATE_CACHE_SIZE:
+            compiled.popitem(last=False)
+    else:
+        compiled.move_to_end(source)
+    return template
+
+def stats():
+    return {
+        "compiled": len(compiled),
+        "max": TEMPLATE_CACHE_SIZE,
+        "time_formats": format_time.cache_info()._asdict(),
+    }